@@ -0,0 +1,548 @@
+import cv2
+import json
+import logging
+import io
+import math
+import os
+import shutil
+import subprocess
+import time
+import numpy as np
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from remote import RangeFile, StreamPath, open_source
+from stats import StageTimer
+
+try:
+    import av
+except ImportError:
+    av = None
+
+FFMPEG = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+
+
+def open_capture(file: Path, params: list[int] | None = None
+                 ) -> tuple[cv2.VideoCapture, io.BufferedReader | None]:
+    # File objects, and URLs through the block cache, are read by OpenCV through their read
+    # and seek. OpenCV does not hold on to the file object, so it is returned to be kept
+    # until the capture is released.
+    source = open_source(file)
+    if source is not None:
+        stream = io.BufferedReader(source)
+        return cv2.VideoCapture(stream, cv2.CAP_FFMPEG, params or []), stream
+    if params is not None:
+        return cv2.VideoCapture(str(file), cv2.CAP_FFMPEG, params), None
+    return cv2.VideoCapture(str(file)), None
+
+
+def log_fetched(source: io.RawIOBase | None, file: Path) -> None:
+    if isinstance(source, RangeFile):
+        logging.info(
+            f"Fetched {source.fetched / 1e6:.2f} of {source.size / 1e6:.2f} MB "
+            f"in {source.requests} requests from {file.name}")
+
+
+def probe_codec(file: Path) -> str:
+    vidcap, source = open_capture(file)
+    if not vidcap.isOpened():
+        vidcap.release()
+        return ''
+    fourcc = int(vidcap.get(cv2.CAP_PROP_FOURCC))
+    vidcap.release()
+    return ''.join(chr(fourcc >> 8 * i & 0xFF) for i in range(4)).strip('\x00 ')
+
+
+def scaled_size(width: int, height: int, max_side: int | None = None,
+                size: tuple[int, int] | None = None) -> tuple[int, int] | None:
+    if size is not None:
+        return size
+    if max_side is None or max(width, height) <= max_side:
+        return None
+    scale = max_side / max(width, height)
+    return max(round(width * scale), 1), max(round(height * scale), 1)
+
+
+class Decoder(ABC):
+    # position is the index of the next frame to be read, as CAP_PROP_POS_FRAMES.
+    # Frames are returned at out_size (width, height) if it is set.
+    NAME = ''
+
+    def __init__(self, file: Path, max_side: int | None = None,
+                 size: tuple[int, int] | None = None) -> None:
+        self.file = file
+        self.max_side = max_side
+        self.size = size
+        self.out_size: tuple[int, int] | None = None
+
+    def set_out_size(self) -> None:
+        self.out_size = scaled_size(self.width, self.height, self.max_side, self.size)
+
+    @property
+    @abstractmethod
+    def frame_count(self) -> int:
+        ...
+
+    @property
+    @abstractmethod
+    def fps(self) -> float:
+        ...
+
+    @property
+    @abstractmethod
+    def width(self) -> int:
+        ...
+
+    @property
+    @abstractmethod
+    def height(self) -> int:
+        ...
+
+    @property
+    @abstractmethod
+    def position(self) -> int:
+        ...
+
+    @property
+    @abstractmethod
+    def msec(self) -> float:
+        ...
+
+    @abstractmethod
+    def seek(self, frame: int) -> bool:
+        ...
+
+    @abstractmethod
+    def seek_msec(self, msec: float) -> bool:
+        # The next frame read is the first one at or after msec.
+        ...
+
+    @abstractmethod
+    def grab(self) -> bool:
+        ...
+
+    @abstractmethod
+    def retrieve(self) -> np.ndarray | None:
+        ...
+
+    def read(self) -> np.ndarray | None:
+        return self.retrieve() if self.grab() else None
+
+    def probe_keyframes(self) -> list[int]:
+        # Raw packet mode only demuxes, so this walks the container without decoding.
+        rawcap, source = open_capture(self.file, [cv2.CAP_PROP_FORMAT, -1])
+        keyframes: list[int] = []
+        idx = 0
+        while rawcap.grab():
+            if rawcap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(idx)
+            idx += 1
+        rawcap.release()
+        return keyframes
+
+    def reopen(self) -> 'Decoder':
+        self.release()
+        return type(self)(self.file, self.max_side, self.size)
+
+    def release(self) -> None:
+        pass
+
+
+class OpenCVDecoder(Decoder):
+    NAME = 'opencv'
+
+    def __init__(self, file: Path, max_side: int | None = None,
+                 size: tuple[int, int] | None = None) -> None:
+        super().__init__(file, max_side, size)
+        self.vidcap, self.source = open_capture(file)
+        self.set_out_size()
+
+    @property
+    def frame_count(self) -> int:
+        return int(self.vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    @property
+    def fps(self) -> float:
+        return self.vidcap.get(cv2.CAP_PROP_FPS)
+
+    @property
+    def width(self) -> int:
+        return int(self.vidcap.get(cv2.CAP_PROP_FRAME_WIDTH))
+
+    @property
+    def height(self) -> int:
+        return int(self.vidcap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    @property
+    def position(self) -> int:
+        return int(self.vidcap.get(cv2.CAP_PROP_POS_FRAMES))
+
+    @property
+    def msec(self) -> float:
+        return self.vidcap.get(cv2.CAP_PROP_POS_MSEC)
+
+    def seek(self, frame: int) -> bool:
+        return self.vidcap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+
+    def seek_msec(self, msec: float) -> bool:
+        # OpenCV lands on the frame nearest to the time by fps, so the time of
+        # the first frame at or after msec is given.
+        fps = self.fps
+        if fps > 0:
+            msec = math.ceil(msec * fps / 1000 - 0.001) * 1000 / fps
+        return self.vidcap.set(cv2.CAP_PROP_POS_MSEC, msec)
+
+    def grab(self) -> bool:
+        return self.vidcap.grab()
+
+    def retrieve(self) -> np.ndarray | None:
+        success, image = self.vidcap.retrieve()
+        if not success:
+            return None
+        if self.out_size is not None:
+            # OpenCV cannot scale while decoding, so resize right after it.
+            image = cv2.resize(image, self.out_size, interpolation=cv2.INTER_AREA)
+        return image
+
+    def release(self) -> None:
+        self.vidcap.release()
+        log_fetched(self.source.raw if self.source is not None else None, self.file)
+
+
+class PyAVDecoder(Decoder):
+    NAME = 'pyav'
+
+    def __init__(self, file: Path, max_side: int | None = None,
+                 size: tuple[int, int] | None = None) -> None:
+        if av is None:
+            raise ImportError("PyAV is not installed. Run: pip install av")
+        super().__init__(file, max_side, size)
+        # URLs are read through the block cache, by byte ranges.
+        self.source = open_source(file)
+        self.container = av.open(self.source if self.source is not None else str(file))
+        self.stream = self.container.streams.video[0]
+        # Frame and slice threads of the codec decode in parallel.
+        self.stream.thread_type = 'AUTO'
+        self.start = self.stream.start_time or 0
+        self.frames = self.container.decode(self.stream)
+        self.frame = None
+        self.peeked = None
+        self.next_index = 0
+        self.set_out_size()
+
+    @property
+    def frame_count(self) -> int:
+        if self.stream.frames:
+            return self.stream.frames
+        if self.stream.duration is not None:
+            return int(self.stream.duration * self.stream.time_base * self.fps)
+        if self.container.duration is not None:
+            return int(self.container.duration / av.time_base * self.fps)
+        return 0
+
+    @property
+    def fps(self) -> float:
+        rate = self.stream.average_rate or self.stream.guessed_rate
+        return float(rate) if rate else 0.0
+
+    @property
+    def width(self) -> int:
+        return self.stream.codec_context.width
+
+    @property
+    def height(self) -> int:
+        return self.stream.codec_context.height
+
+    @property
+    def position(self) -> int:
+        return self.next_index
+
+    @property
+    def msec(self) -> float:
+        if self.frame is None or self.frame.pts is None:
+            return 0.0
+        return float((self.frame.pts - self.start) * self.stream.time_base * 1000)
+
+    def index_of(self, pts: int) -> int:
+        return round((pts - self.start) * self.stream.time_base * self.fps)
+
+    def seek(self, frame: int) -> bool:
+        if self.fps <= 0:
+            return False
+        pts = self.start + int((frame + 0.5) / self.fps / self.stream.time_base)
+        self.container.seek(pts, stream=self.stream, backward=True)
+        self.frames = self.container.decode(self.stream)
+        # The landed keyframe is decoded now so that position is known.
+        self.peeked = next(self.frames, None)
+        if self.peeked is None or self.peeked.pts is None:
+            return False
+        self.next_index = self.index_of(self.peeked.pts)
+        return True
+
+    def seek_msec(self, msec: float) -> bool:
+        pts = self.start + int(msec / 1000 / self.stream.time_base)
+        self.container.seek(pts, stream=self.stream, backward=True)
+        self.frames = self.container.decode(self.stream)
+        # Frames from the keyframe are decoded until the time, so variable frame rates are exact.
+        for frame in self.frames:
+            if frame.pts is not None \
+                    and (frame.pts - self.start) * self.stream.time_base * 1000 >= msec - 0.001:
+                self.peeked = frame
+                self.next_index = self.index_of(frame.pts)
+                return True
+        return False
+
+    def grab(self) -> bool:
+        if self.peeked is not None:
+            self.frame, self.peeked = self.peeked, None
+        else:
+            self.frame = next(self.frames, None)
+        if self.frame is None:
+            return False
+        self.next_index = self.index_of(self.frame.pts) \
+            if self.frame.pts is not None else self.next_index
+        self.next_index += 1
+        return True
+
+    def retrieve(self) -> np.ndarray | None:
+        if self.frame is None:
+            return None
+        if self.out_size is not None:
+            # Scaled by swscale together with the pixel format conversion.
+            width, height = self.out_size
+            return self.frame.to_ndarray(
+                format='bgr24', width=width, height=height, interpolation='AREA')
+        return self.frame.to_ndarray(format='bgr24')
+
+    def probe_keyframes(self) -> list[int]:
+        source = open_source(self.file)
+        container = av.open(source if source is not None else str(self.file))
+        stream = container.streams.video[0]
+        keys = []
+        for packet in container.demux(stream):
+            if packet.pts is not None and packet.is_keyframe:
+                keys.append(packet.pts)
+        container.close()
+        return sorted(self.index_of(pts) for pts in keys)
+
+    def release(self) -> None:
+        self.container.close()
+        log_fetched(self.source, self.file)
+
+
+class FFmpegPipeDecoder(Decoder):
+    # ffmpeg decodes and converts in its own process and streams raw BGR frames over a pipe.
+    NAME = 'ffmpeg'
+
+    def __init__(self, file: Path, max_side: int | None = None,
+                 size: tuple[int, int] | None = None) -> None:
+        if isinstance(file, StreamPath):
+            raise ValueError("ffmpeg cannot read file objects. Use opencv or pyav")
+        super().__init__(file, max_side, size)
+        vidcap, source = open_capture(file)
+        self._frame_count = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self._fps = vidcap.get(cv2.CAP_PROP_FPS)
+        self._width = int(vidcap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self._height = int(vidcap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        vidcap.release()
+        self.set_out_size()
+        self.out_width, self.out_height = self.out_size or (self._width, self._height)
+        self.frame_size = self.out_width * self.out_height * 3
+        self.proc: subprocess.Popen | None = None
+        self.buf: bytes | None = None
+        self.next_index = 0
+
+    @property
+    def frame_count(self) -> int:
+        return self._frame_count
+
+    @property
+    def fps(self) -> float:
+        return self._fps
+
+    @property
+    def width(self) -> int:
+        return self._width
+
+    @property
+    def height(self) -> int:
+        return self._height
+
+    @property
+    def position(self) -> int:
+        return self.next_index
+
+    @property
+    def msec(self) -> float:
+        return (self.next_index - 1) * 1000 / self._fps if self._fps > 0 else 0.0
+
+    def start_pipe(self, frame: int, msec: float | None = None) -> None:
+        self.stop_pipe()
+        cmd = [FFMPEG, '-v', 'error', '-nostdin']
+        if msec is None and frame > 0:
+            msec = (frame - 0.5) * 1000 / self._fps
+        if msec is not None:
+            # Input seeking jumps to the preceding keyframe and drops frames before the time.
+            cmd += ['-ss', f'{msec / 1000:.6f}']
+        cmd += ['-i', str(self.file), '-map', '0:v:0']
+        if self.out_size is not None:
+            cmd += ['-vf', f'scale={self.out_width}:{self.out_height}:flags=area']
+        cmd += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+        self.proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            bufsize=self.frame_size)
+        self.next_index = frame
+
+    def stop_pipe(self) -> None:
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.stdout.close()
+            self.proc.wait()
+            self.proc = None
+
+    def seek(self, frame: int) -> bool:
+        if self._fps <= 0 or self.frame_size == 0:
+            return False
+        self.start_pipe(frame)
+        return True
+
+    def seek_msec(self, msec: float) -> bool:
+        if self._fps <= 0 or self.frame_size == 0:
+            return False
+        self.start_pipe(math.ceil(msec * self._fps / 1000 - 0.001), msec - 0.001)
+        return True
+
+    def grab(self) -> bool:
+        if self.frame_size == 0:
+            return False
+        if self.proc is None:
+            self.start_pipe(self.next_index)
+        self.buf = self.proc.stdout.read(self.frame_size)
+        if len(self.buf) < self.frame_size:
+            self.buf = None
+            return False
+        self.next_index += 1
+        return True
+
+    def retrieve(self) -> np.ndarray | None:
+        if self.buf is None:
+            return None
+        return np.frombuffer(self.buf, np.uint8).reshape(self.out_height, self.out_width, 3)
+
+    def release(self) -> None:
+        self.stop_pipe()
+
+
+class TimedDecoder:
+    # Adds the time of each call to the stages of a timer. Other attributes pass through.
+    def __init__(self, decoder: Decoder, timer: StageTimer) -> None:
+        self.decoder = decoder
+        self.timer = timer
+
+    def __getattr__(self, name: str):
+        return getattr(self.decoder, name)
+
+    def seek(self, frame: int) -> bool:
+        with self.timer.stage('seek'):
+            return self.decoder.seek(frame)
+
+    def seek_msec(self, msec: float) -> bool:
+        with self.timer.stage('seek'):
+            return self.decoder.seek_msec(msec)
+
+    def grab(self) -> bool:
+        with self.timer.stage('decode'):
+            return self.decoder.grab()
+
+    def retrieve(self) -> np.ndarray | None:
+        # Pixel format conversion and scaling happen here in every decoder.
+        with self.timer.stage('convert'):
+            return self.decoder.retrieve()
+
+    def read(self) -> np.ndarray | None:
+        return self.retrieve() if self.grab() else None
+
+    def probe_keyframes(self) -> list[int]:
+        with self.timer.stage('probe'):
+            return self.decoder.probe_keyframes()
+
+    def reopen(self) -> 'TimedDecoder':
+        with self.timer.stage('open'):
+            return TimedDecoder(self.decoder.reopen(), self.timer)
+
+
+DECODERS: dict[str, type[Decoder]] = {
+    OpenCVDecoder.NAME: OpenCVDecoder,
+    PyAVDecoder.NAME: PyAVDecoder,
+    FFmpegPipeDecoder.NAME: FFmpegPipeDecoder
+}
+
+
+def available_decoders() -> list[str]:
+    names = [OpenCVDecoder.NAME]
+    if av is not None:
+        names.append(PyAVDecoder.NAME)
+    if shutil.which(FFMPEG) is not None:
+        names.append(FFmpegPipeDecoder.NAME)
+    return names
+
+
+def open_decoder(name: str, file: Path, max_side: int | None = None,
+                 size: tuple[int, int] | None = None,
+                 timer: StageTimer | None = None) -> Decoder | TimedDecoder:
+    if name not in DECODERS:
+        raise ValueError(f"decoder must be one of {set(DECODERS)}.")
+    if timer is None:
+        return DECODERS[name](file, max_side, size)
+    with timer.stage('open'):
+        return TimedDecoder(DECODERS[name](file, max_side, size), timer)
+
+
+def benchmark(file: Path, names: list[str], frames: int = 30) -> dict[str, float]:
+    # Frames/s of a few seeks, each followed by sequential reads.
+    decoder = OpenCVDecoder(file)
+    frame_count = decoder.frame_count
+    decoder.release()
+    starts = [frame_count * i // 4 for i in range(3)]
+    fps: dict[str, float] = {}
+    for name in names:
+        try:
+            start = time.perf_counter()
+            decoder = open_decoder(name, file)
+            read = 0
+            for frame in starts:
+                decoder.seek(frame)
+                for _ in range(frames // len(starts)):
+                    if decoder.read() is None:
+                        break
+                    read += 1
+            decoder.release()
+            fps[name] = read / (time.perf_counter() - start)
+        except Exception as e:
+            logging.warning(f"Decoder {name} failed on {file.name}: {e}")
+    return fps
+
+
+class DecoderChooser:
+    # Fastest decoder per codec, measured once on this machine and kept in a JSON file.
+    def __init__(self, cache_path: Path, rerun: bool = False) -> None:
+        self.cache_path = cache_path
+        self.choices: dict[str, dict[str, float]] = {}
+        if cache_path.exists() and not rerun:
+            self.choices = json.loads(cache_path.read_text(encoding='utf-8'))
+
+    def choose(self, file: Path) -> str:
+        codec = probe_codec(file)
+        if not codec:
+            # A video that does not open is not measured, nor kept as a codec.
+            return OpenCVDecoder.NAME
+        if codec not in self.choices:
+            fps = benchmark(file, available_decoders())
+            logging.info(f"Decoder benchmark of {codec} on {file.name}:")
+            for name, value in sorted(fps.items(), key=lambda item: -item[1]):
+                logging.info(f"{name:>8} {value:>10.2f} frames/s")
+            self.choices[codec] = fps
+            self.cache_path.write_text(
+                json.dumps(self.choices, indent=2), encoding='utf-8')
+        fps = self.choices[codec]
+        return max(fps, key=fps.get) if fps else OpenCVDecoder.NAME
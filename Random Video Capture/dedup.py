@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+from pathlib import Path
+from typing import Iterator
+
+
+def to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def dhash(image: np.ndarray, size: int = 8) -> int:
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return to_int(bits)
+
+
+def phash(image: np.ndarray, size: int = 8) -> int:
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (size * 4, size * 4), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(np.float32(small))[:size, :size].ravel()
+    bits = low > np.median(low[1:])
+    return to_int(bits)
+
+
+HASHES = {
+    'dhash': dhash,
+    'phash': phash
+}
+
+
+class BKTree:
+    # Children are keyed by hamming distance to their parent, so a search within
+    # radius r only descends into children at distance d - r ~ d + r.
+    def __init__(self) -> None:
+        self.root: tuple[int, dict] | None = None
+        self.size = 0
+
+    def add(self, value: int) -> None:
+        self.size += 1
+        if self.root is None:
+            self.root = (value, {})
+            return
+        node = self.root
+        while True:
+            d = (node[0] ^ value).bit_count()
+            if d == 0:
+                return
+            if d not in node[1]:
+                node[1][d] = (value, {})
+                return
+            node = node[1][d]
+
+    def search(self, value: int, radius: int) -> Iterator[int]:
+        if self.root is None:
+            return
+        stack = [self.root]
+        while stack:
+            node_value, children = stack.pop()
+            d = (node_value ^ value).bit_count()
+            if d <= radius:
+                yield node_value
+            for dist, child in children.items():
+                if d - radius <= dist <= d + radius:
+                    stack.append(child)
+
+    def find(self, value: int, radius: int) -> int | None:
+        return next(self.search(value, radius), None)
+
+
+class HashIndex:
+    # Hashes of every saved frame, appended to a text file and shared by later runs.
+    def __init__(self, path: Path, kind: str = 'dhash', radius: int = 4, load: bool = True) -> None:
+        if kind not in HASHES:
+            raise ValueError(f"kind must be one of {set(HASHES)}.")
+        self.path = path
+        self.kind = kind
+        self.radius = radius
+        self.tree = BKTree()
+        if load and path.exists():
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) >= 2 and fields[0] == kind:
+                        self.tree.add(int(fields[1], 16))
+
+    def hash(self, image: np.ndarray) -> int:
+        return HASHES[self.kind](image)
+
+    def find(self, value: int) -> int | None:
+        return self.tree.find(value, self.radius)
+
+    def add(self, value: int) -> None:
+        self.tree.add(value)
+
+    def save(self, records: list[tuple[int, str]]) -> None:
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for value, output in records:
+                f.write(f"{self.kind}\t{value:016x}\t{output}\n")
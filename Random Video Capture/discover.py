@@ -0,0 +1,80 @@
+import math
+import os
+import random
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Iterable, Iterator, TypeVar, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from index import VideoIndex
+
+T = TypeVar('T')
+VIDEO_EXTS = ('mp4', 'mkv', 'avi', 'mov')
+
+
+def scan(directory: Path) -> Iterator[tuple[str, bool]]:
+    with os.scandir(directory) as it:
+        for entry in it:
+            yield entry.name, entry.is_dir(follow_symlinks=False)
+
+
+def matches(rel: str, include: list[str], exclude: list[str]) -> bool:
+    if any(fnmatch(rel, pattern) for pattern in exclude):
+        return False
+    return not include or any(fnmatch(rel, pattern) for pattern in include)
+
+
+def iter_videos(root: Path, exts: Iterable[str] = VIDEO_EXTS,
+                include: list[str] = [], exclude: list[str] = [],
+                recursive: bool = True, index: 'VideoIndex | None' = None) -> Iterator[Path]:
+    suffixes = {f".{ext.lower().lstrip('.')}" for ext in exts}
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        entries = index.scan_dir(directory) if index is not None else scan(directory)
+        for name, is_dir in entries:
+            path = directory / name
+            rel = path.relative_to(root).as_posix()
+            if is_dir:
+                if recursive and not any(fnmatch(rel, pattern) for pattern in exclude):
+                    stack.append(path)
+            elif path.suffix.lower() in suffixes and matches(rel, include, exclude):
+                yield path
+
+
+def reservoir_sample(items: Iterable[T], k: int, rng: random.Random) -> tuple[list[T], int]:
+    # Algorithm L: the number of items to skip is drawn, so most items cost no random draw.
+    reservoir: list[T] = []
+    n = 0
+    it = iter(items)
+    if k > 0:
+        for item in it:
+            reservoir.append(item)
+            n += 1
+            if n == k:
+                break
+    if n < k or k <= 0:
+        return reservoir, n + sum(1 for _ in it)
+
+    def uniform() -> float:
+        return 1.0 - rng.random()
+
+    w = math.exp(math.log(uniform()) / k)
+    next_n = n + math.floor(math.log(uniform()) / math.log1p(-min(w, 1 - 1e-16))) + 1
+    for item in it:
+        n += 1
+        if n == next_n:
+            reservoir[rng.randrange(k)] = item
+            w *= math.exp(math.log(uniform()) / k)
+            next_n += math.floor(math.log(uniform()) / math.log1p(-min(w, 1 - 1e-16))) + 1
+    return reservoir, n
+
+
+def bernoulli_sample(items: Iterable[T], p: float, rng: random.Random) -> tuple[list[T], int]:
+    selected: list[T] = []
+    n = 0
+    for item in items:
+        n += 1
+        if rng.random() < p:
+            selected.append(item)
+    return selected, n
@@ -0,0 +1,337 @@
+import logging
+import math
+import random
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+import seek
+import sampler
+import score
+import dedup
+import journal
+import profiling
+import remote
+from index import VideoMeta
+from stats import StageTimer, peak_rss, read_bytes
+from writer import ImageWriter, BatchWriter, MemoryWriter
+
+
+@dataclass
+class Job:
+    file: Path
+    save_path: Path
+    name: str
+    seed: int
+    seek_mode: str = 'exact'
+    frames: int = 1
+    sampling: str = 'random'
+    writer_threads: int = 2
+    queue_size: int = 8
+    fmt: str = 'png'
+    level: int | None = None
+    batch: bool = False
+    shard: bool = False
+    meta: VideoMeta | None = None
+    targets: list[int] | None = None
+    decoder: str = 'opencv'
+    max_side: int | None = None
+    size: tuple[int, int] | None = None
+    candidates: int = 8
+    start: float | None = None
+    end: float | None = None
+    spacing: float = 0.0
+    times: list[int] | None = None
+    profile: str | None = None
+    journal: Path | None = None
+    done: list[dict] = field(default_factory=list)
+
+    @property
+    def timed(self) -> bool:
+        return self.start is not None or self.end is not None or self.spacing > 0
+
+    def to_dict(self) -> dict:
+        # Metadata, completed frames and paths of the run are found again on resume.
+        entry = {
+            f.name: getattr(self, f.name) for f in fields(self)
+            if f.name not in ('meta', 'journal', 'done', 'save_path')
+        }
+        entry['file'] = str(self.file.absolute())
+        return entry
+
+    @classmethod
+    def from_dict(cls, entry: dict, save_path: Path, journal: Path | None = None) -> 'Job':
+        size = entry.get('size')
+        return cls(**{
+            **entry,
+            'file': remote.as_path(entry['file']),
+            'save_path': save_path,
+            'size': tuple(size) if size is not None else None,
+            'journal': journal
+        })
+
+
+@dataclass
+class Result:
+    file: Path
+    frames: list[int] = field(default_factory=list)
+    method: str = ''
+    elapsed: float = 0.0
+    timings: dict[str, float] = field(default_factory=dict)
+    counts: dict[str, int] = field(default_factory=dict)
+    meta: VideoMeta | None = None
+    records: list[dict] = field(default_factory=list)
+    logs: list[logging.LogRecord] = field(default_factory=list)
+    images: dict[int, bytes] = field(default_factory=dict)
+    wall: float = 0.0
+    read_bytes: int | None = None
+    peak_rss: int | None = None
+
+
+class RecordCollector(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Format now so the record can be pickled back to the main process.
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+@contextmanager
+def collect_logs() -> Iterator[list[logging.LogRecord]]:
+    root = logging.getLogger()
+    collector = RecordCollector()
+    handlers, root.handlers = root.handlers, [collector]
+    try:
+        yield collector.records
+    finally:
+        root.handlers = handlers
+
+
+# Hashes of frames saved by earlier runs, loaded once per process.
+known: dedup.HashIndex | None = None
+
+
+def init_worker(level: int, dedup_args: tuple[Path, str, int] | None = None) -> None:
+    global known
+    logging.getLogger().setLevel(level)
+    known = dedup.HashIndex(*dedup_args) if dedup_args is not None else None
+
+
+def time_window(job: Job, duration: float, fps: float) -> tuple[int, int]:
+    # The last frame starts one frame before the end of the video.
+    last_ms = (duration - (1 / fps if fps > 0 else 0.0)) * 1000
+    start_ms = round((job.start or 0.0) * 1000)
+    end_ms = math.floor(last_ms) + 1
+    if job.end is not None:
+        end_ms = min(end_ms, round(job.end * 1000))
+    return start_ms, end_ms
+
+
+def open_seeker(job: Job, timer: StageTimer) -> tuple[seek.FrameSeeker, int, float]:
+    meta = job.meta
+    seeker = seek.FrameSeeker(
+        job.file, job.seek_mode, meta.keyframes if meta is not None else None,
+        job.decoder, job.max_side, job.size, timer)
+    if meta is not None:
+        return seeker, meta.frame_count, meta.duration
+    frame_count, last_msec = seeker.find_end()
+    fps = seeker.decoder.fps
+    duration = last_msec / 1000 + (1 / fps if fps > 0 else 0.0) if frame_count > 0 else 0.0
+    return seeker, frame_count, duration
+
+
+def select_targets(job: Job, seeker: seek.FrameSeeker, frame_count: int, duration: float,
+                   timer: StageTimer) -> tuple[list[int] | None, list[int] | None]:
+    # Frames, or times in ms when sampling by time. The other one is None.
+    if job.targets is not None:
+        return sorted(set(job.targets)), None
+    if job.times is not None:
+        return None, sorted(set(job.times))
+    rng = random.Random(job.seed)
+    if job.timed:
+        start_ms, end_ms = time_window(job, duration, seeker.decoder.fps)
+        return None, sampler.pick_times(
+            start_ms, end_ms, job.frames, job.sampling, rng, round(job.spacing * 1000))
+    if job.sampling == score.SAMPLING:
+        return score.pick_best(
+            job.file, frame_count, job.frames, rng, job.candidates,
+            job.seek_mode, seeker.keyframes, job.decoder, timer), None
+    return sampler.pick_frames(frame_count, job.frames, job.sampling, rng), None
+
+
+def read_targets(seeker: seek.FrameSeeker, targets: list[int],
+                 timed: bool) -> Iterator[tuple[int, int, np.ndarray | None]]:
+    # (target, landed frame, image) for frames or times.
+    if timed:
+        return seeker.read_times(targets)
+    return seeker.read_many(targets)
+
+
+def iter_video(job: Job, timer: StageTimer | None = None) -> Iterator[tuple[int, np.ndarray]]:
+    # Selected frames of a job without saving them. The video is released when
+    # the generator is finished or closed.
+    timer = timer if timer is not None else StageTimer()
+    seeker, frame_count, duration = open_seeker(job, timer)
+    try:
+        target_frames, times = select_targets(job, seeker, frame_count, duration, timer)
+        for _, frame, image in read_targets(
+                seeker, times if times is not None else target_frames, times is not None):
+            if image is None:
+                logging.error(f"Cannot read frame {frame} in {job.file.name}")
+                continue
+            yield frame, image
+    finally:
+        seeker.release()
+
+
+def extract_video(job: Job) -> Result:
+    file = job.file
+    result = Result(file)
+    timer = StageTimer()
+    meta = job.meta
+    seeker, frame_count, duration = open_seeker(job, timer)
+    target_frames, times = select_targets(job, seeker, frame_count, duration, timer)
+    if times is not None:
+        logging.info(f"Selected times: {times} ms in {file.name}")
+        plan = {'times': times}
+        done = {record['target_ms'] for record in job.done}
+        todo = [msec for msec in times if msec not in done]
+        reads = read_targets(seeker, todo, True)
+    else:
+        logging.info(f"Selected frames: {target_frames} in {file.name}")
+        plan = {'frames': target_frames}
+        # Keyframe seeking lands before the target, so records keep the target.
+        done = {record.get('target', record['frame']) for record in job.done}
+        todo = [frame for frame in target_frames if frame not in done]
+        if done and job.seek_mode == 'keyframe':
+            # Targets left out after landing on the keyframe of a saved one.
+            landed = {record['frame'] for record in job.done}
+            todo = [frame for frame in todo if seeker.nearest_keyframe(frame) not in landed]
+        reads = read_targets(seeker, todo, False)
+    # A target can still land on a frame saved before, as times do.
+    done_frames = {record['frame'] for record in job.done}
+    if job.journal is not None and job.targets is None and job.times is None:
+        journal.append(job.journal, {'type': 'plan', 'name': job.name, **plan}, sync=True)
+    if done:
+        logging.info(f"Skip {len(done)} frames saved before in {file.name}")
+    pending: dict[Path, dict] = {}
+
+    def saved(save_img: Path) -> None:
+        journal.append(job.journal, {'type': 'done', 'name': job.name, **pending[save_img]})
+
+    if job.batch:
+        writer = BatchWriter(
+            job.save_path / Path(f'{job.name}.npy'), len(todo), timer)
+    elif job.shard:
+        writer = MemoryWriter(timer, job.fmt, job.level)
+    else:
+        writer = ImageWriter(
+            job.writer_threads, job.queue_size, timer, job.fmt, job.level,
+            saved if job.journal is not None else None)
+    # Only duplicates within this video are found here, so results do not depend
+    # on which process handles which video. The main process checks across videos.
+    local = dedup.BKTree()
+    try:
+        for target, target_frame, image in reads:
+            if image is None:
+                logging.error(f"Cannot read frame {target_frame} in {file.name}")
+                continue
+            if target_frame in done_frames:
+                continue
+            if job.batch:
+                save_img = writer.save_file
+            else:
+                save_img = job.save_path / Path(f'{job.name}_{target_frame}.{job.fmt}')
+            if not (job.batch or job.shard) and save_img.exists():
+                logging.warning(f"File exist! Skipped {save_img.name}")
+                continue
+            if known is not None:
+                with timer.stage('hash'):
+                    value = known.hash(image)
+                    duplicate = known.find(value) is not None \
+                        or local.find(value, known.radius) is not None
+                if duplicate:
+                    logging.info(f"Frame {target_frame} in {file.name} is a duplicate. Skipped")
+                    continue
+                local.add(value)
+            result.frames.append(target_frame)
+            result.records.append({
+                'frame': target_frame,
+                'timestamp_ms': round(seeker.frame_msec, 3),
+                'decode_s': round(seeker.frame_elapsed, 6),
+                'output': save_img.as_posix()
+            })
+            if times is not None:
+                result.records[-1]['target_ms'] = target
+            else:
+                result.records[-1]['target'] = target
+            if known is not None:
+                result.records[-1]['hash'] = f'{value:016x}'
+            if job.batch or job.shard:
+                writer.put(target_frame, image)
+            else:
+                pending[save_img] = result.records[-1]
+                writer.put(save_img, image)
+    except Exception:
+        # Frames queued so far are still saved and journaled. A batch is left as its .part.
+        if not job.batch:
+            writer.close()
+        seeker.release()
+        raise
+    if meta is None or (meta.keyframes is None and seeker.keyframes is not None):
+        result.meta = VideoMeta.from_decoder(
+            file, seeker.decoder, seeker.keyframes, frame_count, duration)
+    seeker.release()
+    writer.close()
+    if job.shard:
+        result.images = writer.images
+    result.records = sorted(job.done + result.records, key=lambda record: record['frame'])
+    result.method = seeker.method
+    result.elapsed = seeker.elapsed
+    result.timings = timer.totals
+    result.counts = timer.counts
+    logging.info(
+        f"Read {len(todo)} frames by {seeker.method} with {job.decoder} in {seeker.elapsed:.3f}s")
+    logging.info(f"Stages of {file.name}: {timer.report()}")
+    return result
+
+
+def map_ahead(executor: Executor, fn: Callable, items: Iterable, ahead: int) -> Iterator:
+    # Like executor.map, but at most ahead items are in flight. Results carry the
+    # encoded images of a video, so they must not pile up behind a slow one.
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def run_job(job: Job) -> Result:
+    # Logs of one video are handed back together so that workers never interleave.
+    start, before = time.perf_counter(), read_bytes()
+    with collect_logs() as logs:
+        with profiling.profile(job.profile, profiling.profile_dir(job.save_path), job.name):
+            try:
+                result = extract_video(job)
+            except Exception as e:
+                # A corrupt video is left out instead of ending the whole run.
+                logging.error(f"Cannot extract {job.file.name}: {e}")
+                result = Result(job.file)
+    after = read_bytes()
+    result.wall = time.perf_counter() - start
+    result.read_bytes = after - before if after is not None and before is not None else None
+    result.peak_rss = peak_rss()
+    result.logs = logs
+    return result
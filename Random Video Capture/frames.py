@@ -0,0 +1,60 @@
+import random
+import numpy as np
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator
+
+import extract
+import remote
+from index import VideoIndex
+
+# Frames straight from videos, without writing files. For example:
+#     for path, frame, image in sample_frames(paths, 4, seed=0, max_side=512): ...
+#     for paths, frames, images in sample_batches(paths, 4, seed=0, size=(224, 224)): ...
+# Paths can also be URLs, or seekable binary file objects with opencv or pyav.
+
+
+def sample_frames(paths: Iterable[str | Path | BinaryIO], n: int = 1, seed: int | None = None, *,
+                  sampling: str = 'random', seek_mode: str = 'exact', decoder: str = 'opencv',
+                  max_side: int | None = None, size: tuple[int, int] | None = None,
+                  start: float | None = None, end: float | None = None, spacing: float = 0.0,
+                  candidates: int = 8, index: VideoIndex | None = None
+                  ) -> Iterator[tuple[Path, int, np.ndarray]]:
+    # Videos are opened one at a time while the generator is consumed.
+    # The same seed and paths give the same frames.
+    rng = random.Random(seed)
+    for path in paths:
+        file = remote.as_path(path)
+        job = extract.Job(
+            file, Path('.'), file.stem, rng.getrandbits(32),
+            seek_mode=seek_mode, frames=n, sampling=sampling,
+            meta=None if index is None or isinstance(file, remote.StreamPath) else index.get(file),
+            decoder=decoder, max_side=max_side, size=size, candidates=candidates,
+            start=start, end=end, spacing=spacing)
+        for frame, image in extract.iter_video(job):
+            yield file, frame, image
+
+
+def stack(items: list[tuple[Path, int, np.ndarray]]) -> tuple[list[Path], np.ndarray, np.ndarray]:
+    return (
+        [file for file, _, _ in items],
+        np.array([frame for _, frame, _ in items], dtype=np.int64),
+        np.stack([image for _, _, image in items])
+    )
+
+
+def sample_batches(paths: Iterable[str | Path | BinaryIO], n: int = 1, seed: int | None = None,
+                   batch_size: int = 32, **options) -> Iterator[tuple[list[Path], np.ndarray, np.ndarray]]:
+    # (paths, frames, images of shape (batch, height, width, 3)). At most batch_size
+    # frames are kept. A batch ends early when the frame shape changes, so set
+    # size to get full batches from videos of different resolutions.
+    items: list[tuple[Path, int, np.ndarray]] = []
+    for item in sample_frames(paths, n, seed, **options):
+        if items and item[2].shape != items[0][2].shape:
+            yield stack(items)
+            items = []
+        items.append(item)
+        if len(items) == batch_size:
+            yield stack(items)
+            items = []
+    if items:
+        yield stack(items)
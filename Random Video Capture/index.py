@@ -0,0 +1,90 @@
+import json
+import os
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from decoder import Decoder
+
+
+@dataclass
+class VideoMeta:
+    path: str
+    size: int
+    mtime_ns: int
+    frame_count: int
+    fps: float
+    width: int
+    height: int
+    duration: float
+    keyframes: list[int] | None = None
+
+    @classmethod
+    def from_decoder(cls, file: Path, decoder: 'Decoder', keyframes: list[int] | None = None,
+                     frame_count: int | None = None, duration: float | None = None) -> 'VideoMeta':
+        stat = file.stat()
+        fps = decoder.fps
+        if frame_count is None:
+            frame_count = decoder.frame_count
+        if duration is None:
+            duration = frame_count / fps if fps > 0 else 0.0
+        return cls(
+            str(file.absolute()), stat.st_size, stat.st_mtime_ns, frame_count, fps,
+            decoder.width, decoder.height, duration, keyframes
+        )
+
+
+class VideoIndex:
+    # Entries are keyed by path and stay valid while size and mtime are unchanged.
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS videos ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, frame_count INTEGER, "
+            "fps REAL, width INTEGER, height INTEGER, duration REAL, keyframes TEXT);"
+            "CREATE TABLE IF NOT EXISTS listings ("
+            "path TEXT PRIMARY KEY, mtime_ns INTEGER, entries TEXT);"
+        )
+
+    def get(self, file: Path) -> VideoMeta | None:
+        path = str(file.absolute())
+        row = self.conn.execute(
+            "SELECT * FROM videos WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        meta = VideoMeta(*row)
+        stat = file.stat()
+        if (meta.size, meta.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        if meta.keyframes is not None:
+            meta.keyframes = json.loads(meta.keyframes)
+        return meta
+
+    def put(self, meta: VideoMeta) -> None:
+        keyframes = json.dumps(meta.keyframes) if meta.keyframes is not None else None
+        self.conn.execute(
+            "INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (meta.path, meta.size, meta.mtime_ns, meta.frame_count, meta.fps,
+             meta.width, meta.height, meta.duration, keyframes))
+
+    def scan_dir(self, directory: Path) -> list[tuple[str, bool]]:
+        # A directory's mtime changes only when entries are added, removed or renamed.
+        path = str(directory.absolute())
+        mtime_ns = os.stat(directory).st_mtime_ns
+        row = self.conn.execute(
+            "SELECT mtime_ns, entries FROM listings WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == mtime_ns:
+            return [tuple(entry) for entry in json.loads(row[1])]
+        with os.scandir(directory) as it:
+            entries = [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in it]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO listings VALUES (?, ?, ?)",
+            (path, mtime_ns, json.dumps(entries)))
+        return entries
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
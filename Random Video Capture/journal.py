@@ -0,0 +1,56 @@
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+JOURNAL = 'journal.jsonl'
+
+
+@dataclass
+class State:
+    run: dict = field(default_factory=dict)
+    jobs: list[dict] = field(default_factory=list)
+    plans: dict[str, dict] = field(default_factory=dict)
+    done: dict[str, list[dict]] = field(default_factory=dict)
+    videos: dict[str, list[dict]] = field(default_factory=dict)
+    finished: bool = False
+
+
+def append(path: Path, *entries: dict, sync: bool = False) -> None:
+    # One write with O_APPEND per call, so lines of several processes never interleave.
+    data = ''.join(json.dumps(entry) + '\n' for entry in entries).encode('utf-8')
+    flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+    fd = os.open(path, flags, 0o644)
+    try:
+        os.write(fd, data)
+        if sync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def load(path: Path) -> State:
+    # Entries are keyed by the output name of each video.
+    # run: options. job: planned video. plan: frames or times selected in a video.
+    # done: frame saved. video: video finished with its final records. end: run finished.
+    state = State()
+    for line in path.read_text(encoding='utf-8').splitlines():
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            # The last line is cut if the run was killed while writing it.
+            continue
+        kind = entry.pop('type')
+        if kind == 'run':
+            state.run = entry
+        elif kind == 'job':
+            state.jobs.append(entry)
+        elif kind == 'plan':
+            state.plans[entry.pop('name')] = entry
+        elif kind == 'done':
+            state.done.setdefault(entry.pop('name'), []).append(entry)
+        elif kind == 'video':
+            state.videos[entry['name']] = entry['records']
+        elif kind == 'end':
+            state.finished = True
+    return state
@@ -1,12 +1,32 @@
-import cv2
 import os
 import sys
+import json
+import hashlib
+import time
+import argparse
 import logging
 import colorlog
 import random
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+import seek
+import sampler
+import extract
+import writer
+import discover
+import manifest
+import decoder
+import score
+import dedup
+import journal
+import profiling
+from index import VideoIndex
+from shards import ShardWriter
+from progress import Progress
+from stats import StageTimer, peak_rss, throughput
+
 
 def mkdir(video_path: Path, auto: bool = True) -> None:
     logging.info(f"Input path: {video_path.absolute()}")
@@ -20,34 +40,502 @@ def mkdir(video_path: Path, auto: bool = True) -> None:
         logging.info(f"Path created: {video_path.absolute()}")
 
 
+def video_name(video_path: Path, file: Path) -> str:
+    # Videos in subdirectories keep their relative path, so names never collide.
+    # Others, as URLs, get a short hash of their full path for the same reason.
+    try:
+        return '__'.join(file.relative_to(video_path).with_suffix('').parts)
+    except ValueError:
+        digest = hashlib.sha1(str(file.absolute()).encode('utf-8')).hexdigest()[:8]
+        return f'{file.stem}_{digest}'
+
+
+def video_rel(video_path: Path, file: Path) -> str:
+    try:
+        return file.relative_to(video_path).as_posix()
+    except ValueError:
+        return str(file.absolute())
+
+
+def finish_videos(save_path: Path, entries: list[dict], hashes: dedup.HashIndex | None) -> None:
+    # Hashes are saved only with the journal entries of their videos. Saved earlier,
+    # a resumed run would skip every frame of an unfinished shard as a duplicate.
+    if hashes is not None:
+        hashes.save([
+            (int(record['hash'], 16), record['output'])
+            for entry in entries for record in entry['records']])
+    journal.append(save_path / journal.JOURNAL, *entries)
+
+
+def remove_duplicates(records: list[dict], hashes: dedup.HashIndex, batch: bool) -> list[dict]:
+    kept: list[dict] = []
+    for record in records:
+        value = int(record['hash'], 16)
+        if hashes.find(value) is not None:
+            if batch:
+                logging.warning(f"{record['output']} has a duplicate of an earlier video")
+            else:
+                Path(record['output']).unlink(missing_ok=True)
+                logging.info(f"{record['output']} is removed as a duplicate")
+                continue
+        hashes.add(value)
+        kept.append(record)
+    return kept
+
+
+def parse_size(text: str) -> tuple[int, int]:
+    width, _, height = text.lower().partition('x')
+    try:
+        return int(width), int(height or width)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"size must be WIDTHxHEIGHT, but got {text}")
+
+
+def parse_time(text: str) -> float:
+    # Seconds, MM:SS or HH:MM:SS, with fractions of a second.
+    try:
+        seconds = 0.0
+        for part in text.split(':'):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"time must be seconds or [HH:]MM:SS, but got {text}")
+    if seconds < 0:
+        raise argparse.ArgumentTypeError(f"time must not be negative, but got {text}")
+    return seconds
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Capture some frames from videos randomly.")
+    parser.add_argument(
+        'video_path', type=Path, nargs='?',
+        help="Path of videos. Videos in --manifest are relative to it.")
+    count = parser.add_mutually_exclusive_group()
+    count.add_argument(
+        '--count', type=int,
+        help="Number of videos to extract. Asked interactively if not set.")
+    count.add_argument(
+        '--fraction', type=float,
+        help="Select each video with this probability (0 ~ 1).")
+    count.add_argument(
+        '--manifest', type=Path,
+        help="CSV or JSON of (video, frame) pairs to extract instead of sampling.")
+    count.add_argument(
+        '--replay', type=Path,
+        help="Run manifest (.json) to extract exactly the same frames again.")
+    count.add_argument(
+        '--resume', type=Path,
+        help="Image directory of an interrupted run to finish with the same plan.")
+    parser.add_argument(
+        '--seed', type=int,
+        help="Seed of the random selection. Same seed and videos give the same frames.")
+    parser.add_argument(
+        '--out', type=Path,
+        help="Directory to save images. Default is images_(timestamp).")
+    parser.add_argument(
+        '--seek', choices=seek.FrameSeeker.MODES, default='exact',
+        help="exact: decode forward from the preceding keyframe to the selected frame. "
+             "keyframe: take the nearest preceding keyframe instead.")
+    parser.add_argument(
+        '--frames', type=int, default=1,
+        help="Number of frames to extract from each video.")
+    parser.add_argument(
+        '--sampling', choices=[*sampler.SAMPLINGS, score.SAMPLING], default='random',
+        help="random: any frames. uniform: same stride. "
+             "stratified: one random frame per equal segment. "
+             "best: sharp, not too dark or bright, and different frames among candidates.")
+    parser.add_argument(
+        '--candidates', type=int, default=8,
+        help="Candidates scored per frame to extract with --sampling best.")
+    parser.add_argument(
+        '--start', type=parse_time,
+        help="Sample by time from this time, in seconds or [HH:]MM:SS.")
+    parser.add_argument(
+        '--end', type=parse_time,
+        help="Sample by time until this time, in seconds or [HH:]MM:SS.")
+    parser.add_argument(
+        '--spacing', type=float, default=0.0,
+        help="Sample by time with at least this many seconds between frames.")
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help="Number of processes to extract videos in parallel.")
+    parser.add_argument(
+        '--writer-threads', type=int, default=2,
+        help="Number of threads to encode and save images in each process.")
+    parser.add_argument(
+        '--queue-size', type=int, default=8,
+        help="Number of decoded frames waiting to be saved before decoding blocks.")
+    parser.add_argument(
+        '--format', choices=writer.FORMATS, default='png',
+        help="Image format to save. npy is the raw decoded array.")
+    parser.add_argument(
+        '--quality', type=int,
+        help="jpg and webp quality (0 ~ 100). Default is the OpenCV default.")
+    parser.add_argument(
+        '--compression', type=int,
+        help="png compression level (0 ~ 9). Default is the OpenCV default.")
+    parser.add_argument(
+        '--batch', action='store_true',
+        help="Save all frames of a video into one memory-mappable .npy. Only with --format npy.")
+    parser.add_argument(
+        '--shard-size', type=float,
+        help="Pack frames and their metadata into tar shards of about this many MB, "
+             "with index.csv, instead of one file per frame.")
+    parser.add_argument(
+        '--ext', nargs='+', default=list(discover.VIDEO_EXTS),
+        help="Video extensions to find.")
+    parser.add_argument(
+        '--include', action='append', default=[],
+        help="Glob of paths relative to the video path to include. Can be repeated.")
+    parser.add_argument(
+        '--exclude', action='append', default=[],
+        help="Glob of paths relative to the video path to exclude. Can be repeated.")
+    parser.add_argument(
+        '--no-recursive', action='store_true',
+        help="Find videos only directly in the video path.")
+    parser.add_argument(
+        '--list', type=Path,
+        help="Text file of video paths or http(s) URLs, one per line, "
+             "to select from instead of finding videos in the video path.")
+    parser.add_argument(
+        '--decoder', choices=['auto', *decoder.DECODERS], default='opencv',
+        help="opencv: OpenCV's FFmpeg backend. pyav: PyAV with threaded decoding. "
+             "ffmpeg: raw frames from an ffmpeg process. auto: the fastest per codec.")
+    scale = parser.add_mutually_exclusive_group()
+    scale.add_argument(
+        '--max-side', type=int,
+        help="Downscale frames so that the longer side is at most this. Never upscales.")
+    scale.add_argument(
+        '--size', type=parse_size,
+        help="Resize frames to WIDTHxHEIGHT, or NxN if only N is given.")
+    parser.add_argument(
+        '--benchmark', action='store_true',
+        help="Measure decoders again for --decoder auto.")
+    parser.add_argument(
+        '--benchmark-cache', type=Path, default=Path('.decoder_benchmark.json'),
+        help="Results of the decoder benchmark for --decoder auto.")
+    parser.add_argument(
+        '--dedup', choices=dedup.HASHES,
+        help="Skip frames whose perceptual hash is near one already saved, in this or earlier runs.")
+    parser.add_argument(
+        '--dedup-radius', type=int, default=4,
+        help="Hamming distance of hashes regarded as duplicates.")
+    parser.add_argument(
+        '--dedup-index', type=Path, default=Path('.frame_hashes.txt'),
+        help="Hashes of saved frames, shared by every run.")
+    parser.add_argument(
+        '--index', type=Path,
+        default=Path('.video_index.sqlite'),
+        help="Metadata index of videos, shared by every video path.")
+    parser.add_argument(
+        '--no-index', action='store_true',
+        help="Do not read or update the metadata index.")
+    parser.add_argument(
+        '--profile', choices=profiling.PROFILERS,
+        help="Profile each video with cProfile or pyinstrument, and merge them after the run.")
+    args = parser.parse_args()
+    if args.video_path is None and args.manifest is None and args.replay is None \
+            and args.resume is None and args.list is None:
+        parser.error("video_path is required without --manifest, --replay, --resume or --list")
+    if args.count is None and args.fraction is None and args.manifest is None \
+            and args.replay is None and args.resume is None and not sys.stdin.isatty():
+        parser.error(
+            "--count, --fraction, --manifest, --replay or --resume is required when not interactive")
+    if args.resume is not None and not (args.resume / journal.JOURNAL).exists():
+        parser.error(f"--resume needs {journal.JOURNAL} in {args.resume}")
+    if args.frames < 1:
+        parser.error("--frames must be at least 1")
+    if args.candidates < 1:
+        parser.error("--candidates must be at least 1")
+    if args.decoder == 'pyav' and decoder.av is None:
+        parser.error("--decoder pyav needs PyAV. Run: pip install av")
+    if args.profile == 'pyinstrument' and profiling.pyinstrument is None:
+        parser.error("--profile pyinstrument needs pyinstrument. Run: pip install pyinstrument")
+    if args.fraction is not None and not 0 <= args.fraction <= 1:
+        parser.error("--fraction must be in range (0, 1)")
+    if args.spacing < 0:
+        parser.error("--spacing must not be negative")
+    if args.sampling == score.SAMPLING and (
+            args.start is not None or args.end is not None or args.spacing > 0):
+        parser.error("--sampling best cannot be used with --start, --end or --spacing")
+    if args.start is not None and args.end is not None and args.start >= args.end:
+        parser.error("--start must be before --end")
+    if args.batch and args.format != 'npy':
+        parser.error("--batch requires --format npy")
+    if args.batch and args.shard_size is not None:
+        parser.error("--batch cannot be used with --shard-size")
+    return args
+
+
+def select_videos(args: argparse.Namespace, index: VideoIndex | None,
+                  rng: random.Random) -> dict[Path, list[int] | None]:
+    video_path: Path = args.video_path
+    if args.manifest is not None:
+        pairs = manifest.read_pairs(args.manifest)
+        logging.info(f"Read {len(pairs)} frames from {args.manifest}")
+        return manifest.group_pairs(pairs, video_path)
+    if args.replay is not None:
+        pairs = [(record['video'], record['frame'])
+                 for record in args.run['frames']]
+        logging.info(f"Replay {len(pairs)} frames from {args.replay}")
+        return manifest.group_pairs(pairs, video_path)
+
+    if args.list is not None:
+        files = manifest.iter_list(args.list, video_path)
+    else:
+        files = discover.iter_videos(
+            video_path, args.ext, args.include, args.exclude,
+            not args.no_recursive, index)
+    if args.fraction is not None:
+        samples, max_fnum = discover.bernoulli_sample(files, args.fraction, rng)
+    else:
+        extract_num = args.count
+        if extract_num is None:
+            extract_num = int(input("Put numbers to extract: "))
+        samples, max_fnum = discover.reservoir_sample(files, extract_num, rng)
+        if extract_num not in range(max_fnum + 1):
+            raise ValueError(
+                f"Input not in range. Input is {extract_num}, but range is (0, {max_fnum})")
+    logging.info(f"Selected {len(samples)} of {max_fnum} videos")
+    return {file: None for file in samples}
+
+
+def file_stats(video: str, result: extract.Result) -> dict:
+    written = result.counts.get('bytes', 0)
+    return {
+        'video': video,
+        'frames': len(result.frames),
+        'wall_s': round(result.wall, 6),
+        **throughput(len(result.frames), result.read_bytes, written, result.wall),
+        'read_bytes': result.read_bytes,
+        'written_bytes': written,
+        'peak_rss_mb': round(result.peak_rss / 1e6, 3) if result.peak_rss is not None else None,
+        'stages': {name: round(seconds, 6) for name, seconds in result.timings.items()}
+    }
+
+
+def run_stats(files: list[dict], timer: StageTimer, wall: float) -> dict:
+    # Stages are summed over videos, and writer threads, so they can exceed the wall time.
+    frames = sum(file['frames'] for file in files)
+    reads = [file['read_bytes'] for file in files if file['read_bytes'] is not None]
+    read = sum(reads) if reads or not files else None
+    written = timer.counts.get('bytes', 0)
+    main_rss = peak_rss()
+    peaks = [file['peak_rss_mb'] for file in files if file['peak_rss_mb'] is not None]
+    if main_rss is not None:
+        peaks.append(main_rss / 1e6)
+    return {
+        'videos': len(files),
+        'frames': frames,
+        'wall_s': round(wall, 6),
+        **throughput(frames, read, written, wall),
+        'read_bytes': read,
+        'written_bytes': written,
+        'peak_rss_mb': round(max(peaks), 3) if peaks else None,
+        'stages': {name: round(seconds, 6) for name, seconds in timer.totals.items()},
+        'files': files
+    }
+
+
+def resume_run(args: argparse.Namespace,
+               index: VideoIndex | None) -> tuple[dict, list[extract.Job], list[dict]]:
+    # Videos, seeds and selected frames of the interrupted run are read from its
+    # journal, so the plan is the same and saved frames are never decoded again.
+    save_path: Path = args.resume
+    state = journal.load(save_path / journal.JOURNAL)
+    run = dict(state.run)
+    args.dedup = run.pop('dedup')
+    args.dedup_radius = run.pop('dedup_radius')
+    args.dedup_index = Path(run.pop('dedup_index'))
+    args.video_path = Path(run['video_path'])
+    args.seed = run['seed']
+    args.format, args.batch = run['format'], run['batch']
+    args.shard_size = run.get('shard_size')
+    if state.finished:
+        logging.info(f"{save_path} is already finished")
+    for part in save_path.glob('*.part'):
+        part.unlink()
+    jobs: list[extract.Job] = []
+    records: list[dict] = []
+    for entry in state.jobs:
+        name = entry['name']
+        if name in state.videos:
+            records += state.videos[name]
+            continue
+        job = extract.Job.from_dict(entry, save_path, save_path / journal.JOURNAL)
+        plan = state.plans.get(name, {})
+        if job.targets is None:
+            job.targets = plan.get('frames')
+        job.times = plan.get('times')
+        job.done = state.done.get(name, [])
+        job.meta = index.get(job.file) if index is not None else None
+        jobs.append(job)
+    logging.info(f"Resume {len(jobs)} of {len(state.jobs)} videos in {save_path}")
+    return run, jobs, records
+
+
 def main():
-    video_path = Path(sys.argv[1])
-    mkdir(video_path)
-
-    files = list(video_path.glob('*.mp4'))
-    max_fnum = len(files)
-    extract_num = int(input(f"Put numbers to extract (0 ~ {max_fnum}): "))
-    if extract_num not in range(max_fnum + 1):
-        raise ValueError(
-            f"Input not in range. Input is {extract_num}, but range is (0, {max_fnum})")
-    samples: list[Path] = random.sample(files, extract_num)
-
-    save_path = Path('images_' + datetime.now().strftime('%y%m%d%H%M%S'))
-    save_path.mkdir(parents=True, exist_ok=True)
-
-    for file in samples:
-        vidcap: cv2.VideoCapture = cv2.VideoCapture(str(file))
-        video_length = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
-        target_frame = int(random.randint(0, video_length))
-        logging.info(f"Selected frame: {target_frame} in {file.name}")
-        for t in range(target_frame):
-            success, image = vidcap.read()
-        save_img = save_path / Path(f'{file.stem}_{target_frame}.png')
-        if not save_img.exists():
-            cv2.imwrite(str(save_img), image)
-            logging.info(f"{save_img} is saved.")
-        else:
-            logging.warning(f"File exist! Overwrited {save_img.name}")
+    args = parse_args()
+    level = args.compression if args.format == 'png' else args.quality
+    if args.replay is not None:
+        # Saved frames are found again with direct seeks, in the same format.
+        args.run = manifest.read_run(args.replay)
+        args.video_path = args.video_path or Path(args.run['video_path'])
+        args.format, level, args.batch = \
+            args.run['format'], args.run['level'], args.run['batch']
+        args.max_side = args.run.get('max_side')
+        args.size = tuple(args.run['size']) if args.run.get('size') else None
+        args.seek = 'exact'
+        args.dedup = None
+    index = VideoIndex(args.index) if not args.no_index else None
+
+    if args.resume is not None:
+        save_path: Path = args.resume
+        run, jobs, records = resume_run(args, index)
+        level = run['level']
+        video_path: Path = args.video_path
+    else:
+        if args.video_path is None:
+            args.video_path = Path('.')
+        video_path = args.video_path
+        mkdir(video_path)
+
+        if args.seed is None:
+            args.seed = random.randrange(2**32)
+        logging.info(f"Seed: {args.seed}")
+        rng = random.Random(args.seed)
+        samples = select_videos(args, index, rng)
+
+        save_path = args.out or Path(
+            'images_' + datetime.now().strftime('%y%m%d%H%M%S'))
+        save_path.mkdir(parents=True, exist_ok=True)
+
+        chooser = None
+        if args.decoder == 'auto':
+            chooser = decoder.DecoderChooser(args.benchmark_cache, args.benchmark)
+        # Seeds are drawn here in order, so results do not depend on the scheduling.
+        jobs = [
+            extract.Job(
+                file, save_path, video_name(video_path, file), rng.getrandbits(32),
+                seek_mode=args.seek, frames=args.frames, sampling=args.sampling,
+                writer_threads=args.writer_threads, queue_size=args.queue_size,
+                fmt=args.format, level=level, batch=args.batch,
+                shard=args.shard_size is not None,
+                meta=index.get(file) if index is not None else None,
+                targets=targets,
+                decoder=chooser.choose(file) if chooser is not None else args.decoder,
+                max_side=args.max_side, size=args.size, candidates=args.candidates,
+                start=args.start, end=args.end, spacing=args.spacing,
+                journal=save_path / journal.JOURNAL)
+            for file, targets in samples.items()
+        ]
+        run = {
+            'video_path': str(video_path.absolute()),
+            'seed': args.seed,
+            'seek': args.seek,
+            'sampling': args.sampling,
+            'frames_per_video': args.frames,
+            'start': args.start,
+            'end': args.end,
+            'spacing': args.spacing,
+            'format': args.format,
+            'level': level,
+            'batch': args.batch,
+            'shard_size': args.shard_size,
+            'max_side': args.max_side,
+            'size': args.size
+        }
+        records = []
+        # Written ahead of any work, so --resume can continue the same plan.
+        journal.append(
+            save_path / journal.JOURNAL,
+            {
+                'type': 'run', **run,
+                'dedup': args.dedup, 'dedup_radius': args.dedup_radius,
+                'dedup_index': str(args.dedup_index.absolute())
+            },
+            *[{'type': 'job', **job.to_dict()} for job in jobs],
+            sync=True)
+
+    if args.profile is not None:
+        profiling.profile_dir(save_path).mkdir(exist_ok=True)
+    for job in jobs:
+        job.profile = args.profile
+
+    progress = Progress(len(jobs))
+    timer = StageTimer()
+    files: list[dict] = []
+    shards = None
+    if args.shard_size is not None:
+        shards = ShardWriter(save_path, int(args.shard_size * 1e6), args.format)
+    # Videos in a shard are journaled as finished only when the shard is.
+    waiting: list[dict] = []
+    start = time.perf_counter()
+    hashes = None
+    dedup_args = None
+    if args.dedup is not None:
+        dedup_args = (args.dedup_index, args.dedup, args.dedup_radius)
+        hashes = dedup.HashIndex(*dedup_args, load=False)
+    initargs = (logging.getLogger().level, dedup_args)
+    if args.workers > 1:
+        executor = ProcessPoolExecutor(
+            args.workers, initializer=extract.init_worker, initargs=initargs)
+        results = extract.map_ahead(executor, extract.run_job, jobs, 2 * args.workers)
+    else:
+        executor = None
+        extract.init_worker(*initargs)
+        results = map(extract.run_job, jobs)
+    for job, result in zip(jobs, results):
+        progress.clear()
+        for record in result.logs:
+            logging.getLogger().handle(record)
+        progress.update(len(result.frames))
+        timer.merge(result.timings, result.counts)
+        if hashes is not None:
+            result.records = remove_duplicates(result.records, hashes, args.batch)
+        video = video_rel(video_path, result.file)
+        video_records = [{'video': video, **record} for record in result.records]
+        finished = True
+        if shards is not None:
+            with timer.stage('write'):
+                finished = shards.add(job.name, video_records, result.images)
+        records += video_records
+        files.append(file_stats(video, result))
+        waiting.append({'type': 'video', 'name': job.name, 'records': video_records})
+        if finished:
+            finish_videos(save_path, waiting, hashes)
+            waiting = []
+        if index is not None and result.meta is not None:
+            index.put(result.meta)
+    progress.close()
+    if shards is not None:
+        shards.close()
+        if waiting:
+            finish_videos(save_path, waiting, hashes)
+    if executor is not None:
+        executor.shutdown()
+    if index is not None:
+        index.close()
+    journal.append(save_path / journal.JOURNAL, {'type': 'end'}, sync=True)
+    json_path, csv_path = manifest.write_run(save_path, run, records)
+    logging.info(f"Run manifest is saved at {json_path} and {csv_path}")
+    logging.info(f"Total stages: {timer.report()}")
+    for line in writer.benchmark_table(args.format, level, timer):
+        logging.info(line)
+    stats = run_stats(files, timer, time.perf_counter() - start)
+    stats_path = save_path.with_name(f'{save_path.name}_stats.json')
+    stats_path.write_text(json.dumps(stats, indent=2), encoding='utf-8')
+    read_mb = f"{stats['read_mb_per_s']:.2f} MB/s" if stats['read_mb_per_s'] is not None else 'unknown'
+    peak = f"{stats['peak_rss_mb']:.1f} MB" if stats['peak_rss_mb'] is not None else 'unknown'
+    logging.info(
+        f"{stats['frames_per_s']:.2f} frames/s, read {read_mb}, "
+        f"written {stats['written_mb_per_s']:.2f} MB/s, peak RSS {peak}")
+    logging.info(f"Stats are saved at {stats_path}")
+    if args.profile is not None and files:
+        profile_path, summary = profiling.combine(
+            args.profile, profiling.profile_dir(save_path),
+            save_path.with_name(f'{save_path.name}_profile'))
+        logging.info(f"Profile is saved at {profile_path}\n{summary}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,64 @@
+import csv
+import json
+from pathlib import Path
+from typing import Iterator
+
+from remote import as_path, is_url
+
+RUN_FIELDS = ['video', 'frame', 'timestamp_ms', 'decode_s', 'output']
+
+
+def read_pairs(manifest: Path) -> list[tuple[str, int]]:
+    # JSON: [["a.mp4", 10], {"video": "b.mp4", "frame": 20}, ...]
+    # CSV: one "video,frame" per line, with or without a header.
+    if manifest.suffix.lower() == '.json':
+        rows = json.loads(manifest.read_text(encoding='utf-8'))
+        return [
+            (row['video'], int(row['frame'])) if isinstance(row, dict)
+            else (row[0], int(row[1]))
+            for row in rows
+        ]
+    pairs: list[tuple[str, int]] = []
+    with open(manifest, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#'):
+                continue
+            if not row[1].strip().lstrip('-').isdigit():
+                continue
+            pairs.append((row[0].strip(), int(row[1])))
+    return pairs
+
+
+def iter_list(list_file: Path, root: Path) -> Iterator[Path]:
+    # One video path or URL per line. Paths are relative to root.
+    with open(list_file, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield as_path(line) if is_url(line) else root / line
+
+
+def group_pairs(pairs: list[tuple[str, int]], root: Path) -> dict[Path, list[int]]:
+    # Videos given as URLs are not relative to root.
+    grouped: dict[Path, list[int]] = {}
+    for video, frame in pairs:
+        grouped.setdefault(as_path(video) if is_url(video) else root / video, []).append(frame)
+    return grouped
+
+
+def write_run(save_path: Path, run: dict, records: list[dict]) -> tuple[Path, Path]:
+    # Written next to the image directory. The CSV is also readable by --manifest.
+    json_path = save_path.with_name(f'{save_path.name}.json')
+    csv_path = save_path.with_name(f'{save_path.name}.csv')
+    json_path.write_text(
+        json.dumps({**run, 'frames': records}, indent=2), encoding='utf-8')
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        extra = [key for key in (records[0] if records else {}) if key not in RUN_FIELDS]
+        writer = csv.DictWriter(f, RUN_FIELDS + extra)
+        writer.writeheader()
+        writer.writerows(records)
+    return json_path, csv_path
+
+
+def read_run(run_path: Path) -> dict:
+    return json.loads(run_path.read_text(encoding='utf-8'))
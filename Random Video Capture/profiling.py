@@ -0,0 +1,65 @@
+import cProfile
+import io
+import pstats
+from contextlib import contextmanager
+from functools import reduce
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import pyinstrument
+    from pyinstrument.renderers import HTMLRenderer
+    from pyinstrument.session import Session
+except ImportError:
+    pyinstrument = None
+
+PROFILERS = ('cprofile', 'pyinstrument')
+SUFFIXES = {'cprofile': '.prof', 'pyinstrument': '.pyisession'}
+
+
+def profile_dir(save_path: Path) -> Path:
+    return save_path.with_name(f'{save_path.name}_profile')
+
+
+@contextmanager
+def profile(kind: str | None, profile_dir: Path, name: str) -> Iterator[None]:
+    # Each video is profiled on its own, as it may run in another process.
+    if kind is None:
+        yield
+        return
+    out = profile_dir / f'{name}{SUFFIXES[kind]}'
+    if kind == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(out)
+        return
+    if pyinstrument is None:
+        raise ImportError("pyinstrument is not installed. Run: pip install pyinstrument")
+    profiler = pyinstrument.Profiler()
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        profiler.last_session.save(str(out))
+
+
+def combine(kind: str, profile_dir: Path, out: Path, top: int = 20) -> tuple[Path, str]:
+    # Profiles of all videos are merged into one, with a summary of the slowest calls.
+    files = sorted(profile_dir.glob(f'*{SUFFIXES[kind]}'))
+    if not files:
+        raise FileNotFoundError(f"No profiles in {profile_dir}")
+    if kind == 'cprofile':
+        path = out.with_name(f'{out.name}.prof')
+        pstats.Stats(*map(str, files)).dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(str(path), stream=summary).sort_stats('cumulative').print_stats(top)
+        return path, summary.getvalue()
+    session = reduce(Session.combine, (Session.load(str(file)) for file in files))
+    path = out.with_name(f'{out.name}.html')
+    path.write_text(HTMLRenderer().render(session), encoding='utf-8')
+    return path, f"Open {path} in a browser"
@@ -0,0 +1,32 @@
+import sys
+import time
+
+
+class Progress:
+    def __init__(self, total: int, width: int = 30) -> None:
+        self.total = total
+        self.width = width
+        self.files = 0
+        self.frames = 0
+        self.start = time.perf_counter()
+
+    def clear(self) -> None:
+        sys.stderr.write("\r\033[K")
+
+    def update(self, frames: int) -> None:
+        self.files += 1
+        self.frames += frames
+        self.draw()
+
+    def draw(self) -> None:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        done = self.files / self.total if self.total else 1
+        bar = '#' * int(done * self.width)
+        sys.stderr.write(
+            f"\r[{bar:<{self.width}}] {self.files}/{self.total} files "
+            f"{self.files / elapsed:.2f} files/s {self.frames / elapsed:.2f} frames/s")
+        sys.stderr.flush()
+
+    def close(self) -> None:
+        sys.stderr.write("\n")
+        sys.stderr.flush()
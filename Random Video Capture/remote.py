@@ -0,0 +1,359 @@
+import argparse
+import http.server
+import io
+import logging
+import os
+import re
+import threading
+import urllib.request
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from pathlib import Path, PurePosixPath
+from types import SimpleNamespace
+from typing import BinaryIO
+from urllib.parse import unquote, urlsplit
+
+BLOCK_SIZE = 1 << 20
+CACHE_BLOCKS = 64
+TIMEOUT = 30
+
+
+def is_url(path: str | Path) -> bool:
+    return isinstance(path, UrlPath) or re.match(r'https?://', str(path)) is not None
+
+
+def as_path(path: 'str | Path | UrlPath | BinaryIO') -> 'Path | UrlPath | StreamPath':
+    if isinstance(path, (Path, UrlPath, StreamPath)):
+        return path
+    if hasattr(path, 'read') and hasattr(path, 'seek'):
+        return StreamPath(path)
+    return UrlPath(path) if is_url(path) else Path(path)
+
+
+def open_source(file: 'Path | UrlPath | StreamPath') -> io.RawIOBase | None:
+    # File object for decoders to read through, or None for a local path.
+    if isinstance(file, StreamPath):
+        return file.open()
+    if is_url(file):
+        return RangeFile(str(file))
+    return None
+
+
+class UrlPath:
+    # Stands in for Path where videos are used, so that a URL can be sampled like a file.
+    # stat() has the size and modified time from a HEAD request for the metadata index.
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.pure = PurePosixPath(unquote(urlsplit(url).path))
+        self._stat: SimpleNamespace | None = None
+
+    def __str__(self) -> str:
+        return self.url
+
+    def __repr__(self) -> str:
+        return f"UrlPath({self.url!r})"
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, UrlPath) and other.url == self.url
+
+    def __hash__(self) -> int:
+        return hash(self.url)
+
+    @property
+    def name(self) -> str:
+        return self.pure.name
+
+    @property
+    def stem(self) -> str:
+        return self.pure.stem
+
+    @property
+    def suffix(self) -> str:
+        return self.pure.suffix
+
+    def absolute(self) -> 'UrlPath':
+        return self
+
+    def as_posix(self) -> str:
+        return self.url
+
+    def relative_to(self, other: Path) -> Path:
+        raise ValueError(f"{self.url} is not in {other}")
+
+    def exists(self) -> bool:
+        try:
+            self.stat()
+        except OSError:
+            return False
+        return True
+
+    def stat(self) -> SimpleNamespace:
+        if self._stat is None:
+            request = urllib.request.Request(self.url, method='HEAD')
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                modified = response.headers.get('Last-Modified')
+                self._stat = SimpleNamespace(
+                    st_size=int(response.headers.get('Content-Length', 0)),
+                    st_mtime_ns=int(parsedate_to_datetime(modified).timestamp() * 1e9)
+                    if modified else 0)
+        return self._stat
+
+
+class StreamPath:
+    # Stands in for Path for a seekable binary file object, such as an open file
+    # or a file of an object storage client. It cannot be sent to other processes.
+    def __init__(self, stream: BinaryIO, name: str | None = None) -> None:
+        self.stream = stream
+        if name is None:
+            name = os.path.basename(str(getattr(stream, 'name', '') or '')) or f'stream-{id(stream):x}'
+        self.pure = PurePosixPath(name)
+        self.lock = threading.Lock()
+
+    def __str__(self) -> str:
+        return self.pure.name
+
+    def __repr__(self) -> str:
+        return f"StreamPath({self.stream!r})"
+
+    @property
+    def name(self) -> str:
+        return self.pure.name
+
+    @property
+    def stem(self) -> str:
+        return self.pure.stem
+
+    @property
+    def suffix(self) -> str:
+        return self.pure.suffix
+
+    def absolute(self) -> 'StreamPath':
+        return self
+
+    def as_posix(self) -> str:
+        return self.pure.name
+
+    def relative_to(self, other: Path) -> Path:
+        raise ValueError(f"{self.name} is not in {other}")
+
+    def exists(self) -> bool:
+        return True
+
+    def stat(self) -> SimpleNamespace:
+        # No modified time, so stream videos are never found in the metadata index.
+        with self.lock:
+            return SimpleNamespace(st_size=self.stream.seek(0, io.SEEK_END), st_mtime_ns=0)
+
+    def open(self) -> 'StreamView':
+        return StreamView(self)
+
+
+class StreamView(io.RawIOBase):
+    # A position of its own over a shared stream, so a decoder and a keyframe
+    # probe can read the same stream at once.
+    def __init__(self, path: StreamPath) -> None:
+        super().__init__()
+        self.path = path
+        self.pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.path.stat().st_size
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"whence must be 0, 1 or 2, but got {whence}")
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def readinto(self, buffer) -> int:
+        with self.path.lock:
+            self.path.stream.seek(self.pos)
+            data = self.path.stream.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        self.pos += n
+        return n
+
+
+class BlockCache:
+    # Blocks of every URL read in this process, least recently used dropped first.
+    def __init__(self, max_blocks: int = CACHE_BLOCKS) -> None:
+        self.max_blocks = max_blocks
+        self.blocks: OrderedDict[tuple[str, int], bytes] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple[str, int]) -> bytes | None:
+        with self.lock:
+            data = self.blocks.get(key)
+            if data is not None:
+                self.blocks.move_to_end(key)
+            return data
+
+    def put(self, key: tuple[str, int], data: bytes) -> None:
+        with self.lock:
+            self.blocks[key] = data
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+
+
+cache = BlockCache()
+
+
+class RangeFile(io.RawIOBase):
+    # Read-only file over HTTP Range requests. Only the blocks around the read
+    # positions are fetched, so seeking to a keyframe fetches little of the file.
+    def __init__(self, url: str, block_size: int = BLOCK_SIZE) -> None:
+        super().__init__()
+        self.url = url
+        self.block_size = block_size
+        self.size = UrlPath(url).stat().st_size
+        self.pos = 0
+        self.fetched = 0
+        self.requests = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"whence must be 0, 1 or 2, but got {whence}")
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def block(self, index: int) -> bytes:
+        key = (self.url, index)
+        data = cache.get(key)
+        if data is None:
+            start = index * self.block_size
+            end = min(start + self.block_size, self.size) - 1
+            request = urllib.request.Request(self.url, headers={'Range': f'bytes={start}-{end}'})
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                if response.status != 206:
+                    raise OSError(f"{self.url} does not support Range requests")
+                data = response.read()
+            self.fetched += len(data)
+            self.requests += 1
+            cache.put(key, data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        if self.pos >= self.size:
+            return 0
+        data = self.block(self.pos // self.block_size)
+        start = self.pos % self.block_size
+        n = min(len(buffer), len(data) - start)
+        buffer[:n] = data[start:start + n]
+        self.pos += n
+        return n
+
+
+class Window(io.RawIOBase):
+    # The requested range of an open file, streamed without reading it all.
+    def __init__(self, f: io.BufferedReader, length: int) -> None:
+        super().__init__()
+        self.f = f
+        self.left = length
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = self.f.readinto(memoryview(buffer)[:min(len(buffer), self.left)])
+        self.left -= n
+        return n
+
+    def close(self) -> None:
+        self.f.close()
+        super().close()
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # SimpleHTTPRequestHandler ignores Range. Object storage answers it with 206.
+    def send_head(self):
+        range_header = self.headers.get('Range')
+        path = self.translate_path(self.path)
+        if range_header is None or os.path.isdir(path):
+            return super().send_head()
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip())
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+        size = os.fstat(f.fileno()).st_size
+        if match is None or match.group(1) == match.group(2) == '':
+            start, end = 0, size - 1
+        elif match.group(1) == '':
+            start, end = max(size - int(match.group(2)), 0), size - 1
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        if start >= size or start > end:
+            f.close()
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.end_headers()
+            return None
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Last-Modified', self.date_time_string(int(os.fstat(f.fileno()).st_mtime)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        return Window(f, end - start + 1)
+
+    def copyfile(self, source, outputfile) -> None:
+        try:
+            super().copyfile(source, outputfile)
+        except (ConnectionResetError, BrokenPipeError):
+            # FFmpeg asks for open ranges and closes the connection once it has read enough.
+            pass
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+def serve(directory: Path, port: int = 0) -> http.server.ThreadingHTTPServer:
+    # Local stand-in of object storage. The server runs in a daemon thread,
+    # and server.server_address has the port if 0 is given.
+    def handler(*args, **kwargs):
+        return RangeRequestHandler(*args, directory=str(directory), **kwargs)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Serve videos over HTTP with Range requests, as object storage does.")
+    parser.add_argument('directory', type=Path)
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    server = serve(args.directory, args.port)
+    print(f"Serving {args.directory} at http://127.0.0.1:{server.server_address[1]}/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
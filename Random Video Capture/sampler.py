@@ -0,0 +1,51 @@
+import random
+
+
+def pick_random(length: int, n: int, rng: random.Random) -> list[int]:
+    return sorted(rng.sample(range(length), max(min(n, length), 0)))
+
+
+def pick_uniform(length: int, n: int, rng: random.Random) -> list[int]:
+    n = min(n, length)
+    if n <= 0:
+        return []
+    stride = length / n
+    offset = rng.random() * stride
+    return [int(offset + i * stride) for i in range(n)]
+
+
+def pick_stratified(length: int, n: int, rng: random.Random) -> list[int]:
+    n = min(n, length)
+    if n <= 0:
+        return []
+    bounds = [round(i * length / n) for i in range(n + 1)]
+    return [rng.randrange(lo, hi) for lo, hi in zip(bounds, bounds[1:])]
+
+
+SAMPLINGS = {
+    'random': pick_random,
+    'uniform': pick_uniform,
+    'stratified': pick_stratified
+}
+
+
+def pick_frames(length: int, n: int, how: str = 'random', rng: random.Random | None = None) -> list[int]:
+    if how not in SAMPLINGS:
+        raise ValueError(f"how must be one of {set(SAMPLINGS)}.")
+    if rng is None:
+        rng = random.Random()
+    return SAMPLINGS[how](max(length, 0), n, rng)
+
+
+def pick_times(start_ms: int, end_ms: int, n: int, how: str = 'random',
+               rng: random.Random | None = None, spacing_ms: int = 0) -> list[int]:
+    # Times in [start_ms, end_ms) at least spacing_ms apart. They are picked in a span
+    # shortened by the gaps, and the gaps are put back in order.
+    span = end_ms - start_ms
+    if span <= 0:
+        return []
+    if spacing_ms > 0:
+        n = min(n, (span - 1) // spacing_ms + 1)
+    free = span - (n - 1) * spacing_ms
+    picks = sorted(pick_frames(free, n, how, rng))
+    return [start_ms + pick + i * spacing_ms for i, pick in enumerate(picks)]
@@ -0,0 +1,79 @@
+import cv2
+import random
+import numpy as np
+from pathlib import Path
+
+import sampler
+from seek import FrameSeeker
+from stats import StageTimer
+
+SAMPLING = 'best'
+SCORE_SIDE = 96
+DARK = 16
+BRIGHT = 240
+BINS = 32
+
+
+def sharpness(grays: np.ndarray) -> np.ndarray:
+    # Variance of the 4-neighbour Laplacian of every frame at once.
+    lap = grays[:, :-2, 1:-1] + grays[:, 2:, 1:-1] + grays[:, 1:-1, :-2] \
+        + grays[:, 1:-1, 2:] - 4 * grays[:, 1:-1, 1:-1]
+    return lap.reshape(len(grays), -1).var(axis=1)
+
+
+def brightness(grays: np.ndarray) -> np.ndarray:
+    return grays.reshape(len(grays), -1).mean(axis=1)
+
+
+def histograms(grays: np.ndarray, bins: int = BINS) -> np.ndarray:
+    n = len(grays)
+    idx = (grays.astype(np.int64) * bins // 256).reshape(n, -1)
+    idx += np.arange(n)[:, None] * bins
+    hists = np.bincount(idx.ravel(), minlength=n * bins).reshape(n, bins)
+    return hists / idx.shape[1]
+
+
+def hist_distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Total variation distance between histograms, from 0 to 1.
+    return 0.5 * np.abs(a - b).sum(axis=-1)
+
+
+def select_best(grays: np.ndarray, k: int, min_distance: float = 0.05) -> list[int]:
+    grays = grays.astype(np.float32)
+    sharp = sharpness(grays)
+    bright = brightness(grays)
+    hists = histograms(grays)
+    # Candidates far from the previous one are likely a new scene.
+    steps = hist_distance(hists[1:], hists[:-1])
+    novelty = np.r_[steps[:1], steps] if len(steps) else np.zeros(1)
+    score = sharp / (sharp.max() or 1.0) * (1.0 + novelty)
+    score[(bright < DARK) | (bright > BRIGHT)] = -np.inf
+    # Each pick is compared only with the ones chosen before it,
+    # so memory stays linear in the number of candidates.
+    chosen: list[int] = []
+    for i in np.argsort(-score, kind='stable'):
+        if len(chosen) == k or score[i] == -np.inf:
+            break
+        if not chosen or hist_distance(hists[chosen], hists[i]).min() >= min_distance:
+            chosen.append(int(i))
+    return sorted(chosen)
+
+
+def pick_best(file: Path, frame_count: int, k: int, rng: random.Random, factor: int = 8,
+              seek_mode: str = 'exact', keyframes: list[int] | None = None,
+              decoder: str = 'opencv', timer: StageTimer | None = None) -> list[int]:
+    timer = timer if timer is not None else StageTimer()
+    candidates = sampler.pick_stratified(frame_count, k * factor, rng)
+    seeker = FrameSeeker(file, seek_mode, keyframes, decoder, max_side=SCORE_SIDE, timer=timer)
+    frames: list[int] = []
+    grays: list[np.ndarray] = []
+    for _, frame, image in seeker.read_many(candidates):
+        if image is not None:
+            frames.append(frame)
+            with timer.stage('score'):
+                grays.append(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+    seeker.release()
+    if not frames:
+        return []
+    with timer.stage('score'):
+        return [frames[i] for i in select_best(np.stack(grays), k)]
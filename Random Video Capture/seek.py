@@ -0,0 +1,170 @@
+import logging
+import time
+import numpy as np
+from bisect import bisect_right
+from pathlib import Path
+from typing import Iterator
+
+from decoder import open_decoder
+from stats import StageTimer
+
+
+class FrameSeeker:
+    MODES = ('exact', 'keyframe')
+    SEEK_GAP = 60
+
+    def __init__(self, file: Path, mode: str = 'exact', keyframes: list[int] | None = None,
+                 decoder: str = 'opencv', max_side: int | None = None,
+                 size: tuple[int, int] | None = None, timer: StageTimer | None = None) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {self.MODES}.")
+        self.file = file
+        self.mode = mode
+        self.keyframes = keyframes
+        self.decoder = open_decoder(decoder, file, max_side, size, timer)
+        self.method = mode
+        self.elapsed = 0.0
+        self.frame_elapsed = 0.0
+        self.frame_msec = 0.0
+        self.next_frame = 0
+
+    @property
+    def frame_count(self) -> int:
+        return self.decoder.frame_count
+
+    @property
+    def position(self) -> int:
+        return self.decoder.position
+
+    def nearest_keyframe(self, target: int) -> int:
+        if self.keyframes is None:
+            self.keyframes = self.decoder.probe_keyframes()
+        i = bisect_right(self.keyframes, target) - 1
+        return self.keyframes[i] if i >= 0 else 0
+
+    def seek(self, target: int) -> bool:
+        start = self.nearest_keyframe(target) \
+            if self.keyframes is not None or self.mode == 'keyframe' else target
+        # Decoding forward is cheaper than seeking back to a keyframe already passed.
+        ahead = self.position <= target
+        if self.mode == 'keyframe':
+            ahead = ahead and self.position == start
+        elif self.keyframes is not None:
+            ahead = ahead and start <= self.position
+        else:
+            ahead = ahead and target - self.position <= self.SEEK_GAP
+        if not ahead and not self.decoder.seek(start):
+            return False
+        if self.mode == 'keyframe':
+            return True
+        while self.position < target:
+            if not self.decoder.grab():
+                return False
+        return self.position == target
+
+    @property
+    def seekable(self) -> bool:
+        # Containers without a usable index report no frame count.
+        return self.frame_count > 0
+
+    def readable(self, frame: int) -> bool:
+        # A frame at or after the index. Some indices have no frame in variable
+        # frame rate videos, as indices are timestamps multiplied by fps.
+        if not self.decoder.seek(frame):
+            return False
+        while self.position <= frame:
+            if not self.decoder.grab():
+                return False
+        return True
+
+    def find_end(self) -> tuple[int, float]:
+        # CAP_PROP_FRAME_COUNT is an estimate in many containers. If its last frame
+        # cannot be read, the real end is bisected with seeks instead of decoding all.
+        count = self.frame_count
+        if count <= 0:
+            return count, 0.0
+        if self.readable(count - 1):
+            return count, self.decoder.msec
+        lo, hi = -1, count - 1
+        last_msec = 0.0
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.readable(mid):
+                lo, last_msec = mid, self.decoder.msec
+            else:
+                hi = mid
+        logging.warning(f"{self.file.name} has {lo + 1} frames, not {count}")
+        return lo + 1, last_msec
+
+    def read(self, target: int) -> tuple[int, np.ndarray | None]:
+        _, frame, image = next(self.read_many([target]))
+        return frame, image
+
+    def read_many(self, targets: list[int]) -> Iterator[tuple[int, int, np.ndarray | None]]:
+        # (target, landed frame, image). A target landing on the frame of the one
+        # before it is skipped, as with keyframe seeking.
+        self.method = self.mode if self.seekable else 'sequential'
+        self.elapsed = 0.0
+        landed = None
+        for target in sorted(set(targets)):
+            start = time.perf_counter()
+            frame, image = self._read(target)
+            self.frame_elapsed = time.perf_counter() - start
+            self.elapsed += self.frame_elapsed
+            if frame == landed:
+                continue
+            landed = frame
+            self.frame_msec = self.decoder.msec
+            yield target, frame, image
+
+    def read_times(self, msecs: list[float]) -> Iterator[tuple[float, int, np.ndarray | None]]:
+        # Each time is sought by timestamp, which stays right in variable frame rate videos.
+        self.method = 'time'
+        self.elapsed = 0.0
+        landed = None
+        for msec in sorted(set(msecs)):
+            start = time.perf_counter()
+            frame, image = self._read_time(msec, landed is not None)
+            self.frame_elapsed = time.perf_counter() - start
+            self.elapsed += self.frame_elapsed
+            if frame == landed:
+                continue
+            landed = frame
+            self.frame_msec = self.decoder.msec
+            yield msec, frame, image
+
+    def _read_time(self, msec: float, started: bool) -> tuple[int, np.ndarray | None]:
+        fps = self.decoder.fps
+        gap = self.SEEK_GAP * 1000 / fps if fps > 0 else 0.0
+        ahead = started and self.decoder.msec < msec <= self.decoder.msec + gap
+        if not ahead and not self.decoder.seek_msec(msec):
+            return self.position, None
+        while self.decoder.grab():
+            if self.decoder.msec >= msec - 0.001:
+                return self.position - 1, self.decoder.retrieve()
+        return self.position, None
+
+    def _read(self, target: int) -> tuple[int, np.ndarray | None]:
+        if self.method != 'sequential':
+            if self.seek(target):
+                landed = self.position
+                image = self.decoder.read()
+                if image is not None and (self.mode == 'keyframe' or self.position - 1 == target):
+                    return landed, image
+            logging.warning(
+                f"Seek is unreliable in {self.file.name}. Skip frames sequentially")
+            self.method = 'sequential'
+            self.decoder = self.decoder.reopen()
+            self.next_frame = 0
+        return target, self.skip_to(target)
+
+    def skip_to(self, target: int) -> np.ndarray | None:
+        # grab() only decodes. Skipped frames are never converted to images.
+        while self.next_frame <= target:
+            if not self.decoder.grab():
+                return None
+            self.next_frame += 1
+        return self.decoder.retrieve()
+
+    def release(self) -> None:
+        self.decoder.release()
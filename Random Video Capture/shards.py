@@ -0,0 +1,106 @@
+import csv
+import io
+import json
+import os
+import tarfile
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from writer import part_path
+
+INDEX = 'index.csv'
+INDEX_FIELDS = ['key', 'shard', 'member', 'offset', 'size', 'video', 'frame']
+
+
+def shard_key(name: str, frame: int) -> str:
+    # WebDataset splits the key from the extension at the first dot.
+    return f"{name.replace('.', '_')}_{frame}"
+
+
+class ShardWriter:
+    # Frames and their metadata go to shard-000000.tar, ... as WebDataset samples:
+    # (key).(format) and (key).json next to each other. A video is never split, so
+    # shards are at least max_bytes except the last one. index.csv has the offset
+    # of every image in the finished shards.
+    def __init__(self, save_path: Path, max_bytes: int, fmt: str) -> None:
+        self.save_path = save_path
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        # Shards left by an interrupted run are kept, and numbering continues after them.
+        self.next_index = len(list(save_path.glob('shard-*.tar')))
+        self.tar: tarfile.TarFile | None = None
+        self.shard: Path | None = None
+        self.rows: list[dict] = []
+
+    def open(self) -> None:
+        self.shard = self.save_path / f'shard-{self.next_index:06d}.tar'
+        self.next_index += 1
+        self.tar = tarfile.open(part_path(self.shard), 'w', format=tarfile.PAX_FORMAT)
+        self.rows = []
+
+    def add_member(self, member: str, data: bytes) -> int:
+        info = tarfile.TarInfo(member)
+        info.size = len(data)
+        info.mode = 0o644
+        self.tar.addfile(info, io.BytesIO(data))
+        # The data is padded to whole blocks after its header.
+        return self.tar.offset - -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+    def add(self, name: str, records: list[dict], images: dict[int, bytes]) -> bool:
+        # Returns True if a shard is finished, with this video in it.
+        if self.tar is None:
+            self.open()
+        for record in records:
+            key = shard_key(name, record['frame'])
+            member = f'{key}.{self.fmt}'
+            data = images[record['frame']]
+            offset = self.add_member(member, data)
+            record['output'] = f'{self.shard.as_posix()}/{member}'
+            meta = {k: v for k, v in record.items() if k != 'output'}
+            self.add_member(f'{key}.json', json.dumps(meta).encode('utf-8'))
+            self.rows.append({
+                'key': key, 'shard': self.shard.name, 'member': member,
+                'offset': offset, 'size': len(data),
+                'video': record.get('video', ''), 'frame': record['frame']
+            })
+        if self.tar.offset < self.max_bytes:
+            return False
+        self.finish()
+        return True
+
+    def finish(self) -> None:
+        if self.tar is None:
+            return
+        self.tar.close()
+        os.replace(part_path(self.shard), self.shard)
+        index = self.save_path / INDEX
+        new = not index.exists()
+        with open(index, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, INDEX_FIELDS)
+            if new:
+                writer.writeheader()
+            writer.writerows(self.rows)
+        self.tar = None
+
+    def close(self) -> None:
+        self.finish()
+
+
+def iter_shards(paths: Iterable[str | Path]) -> Iterator[tuple[str, dict, bytes]]:
+    # (key, metadata, encoded image), read sequentially with no seeks.
+    for path in paths:
+        with tarfile.open(path, 'r|') as tar:
+            key, meta, data = None, None, None
+            for info in tar:
+                member_key, _, ext = info.name.partition('.')
+                content = tar.extractfile(info).read()
+                if member_key != key:
+                    if data is not None:
+                        yield key, meta or {}, data
+                    key, meta, data = member_key, None, None
+                if ext == 'json':
+                    meta = json.loads(content)
+                else:
+                    data = content
+            if data is not None:
+                yield key, meta or {}, data
@@ -0,0 +1,82 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class StageTimer:
+    def __init__(self) -> None:
+        self.totals: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def merge(self, totals: dict[str, float], counts: dict[str, int] = {}) -> None:
+        for name, seconds in totals.items():
+            self.add(name, seconds)
+        for name, n in counts.items():
+            self.count(name, n)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def report(self) -> str:
+        return ', '.join(f"{name} {seconds:.3f}s" for name, seconds in self.totals.items())
+
+
+def peak_rss() -> int | None:
+    # Bytes. ru_maxrss is in KB on Linux and in bytes on macOS.
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+    if psutil is not None:
+        return psutil.Process().memory_info().peak_wset
+    return None
+
+
+def read_bytes() -> int | None:
+    # Bytes read by this process, including reads inside the decoder libraries.
+    if psutil is not None:
+        counters = psutil.Process().io_counters()
+        return getattr(counters, 'read_chars', counters.read_bytes)
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def throughput(frames: int, bytes_read: int | None, bytes_written: int,
+               seconds: float) -> dict[str, float | None]:
+    seconds = max(seconds, 1e-9)
+    return {
+        'frames_per_s': round(frames / seconds, 3),
+        'read_mb_per_s': round(bytes_read / seconds / 1e6, 3) if bytes_read is not None else None,
+        'written_mb_per_s': round(bytes_written / seconds / 1e6, 3)
+    }
@@ -0,0 +1,163 @@
+import cv2
+import io
+import logging
+import os
+import queue
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Callable
+
+from stats import StageTimer
+
+
+FORMATS = ('png', 'jpg', 'webp', 'npy')
+LEVEL_PARAMS = {
+    'png': cv2.IMWRITE_PNG_COMPRESSION,
+    'jpg': cv2.IMWRITE_JPEG_QUALITY,
+    'webp': cv2.IMWRITE_WEBP_QUALITY
+}
+
+
+def encode(image: np.ndarray, fmt: str = 'png', level: int | None = None) -> bytes:
+    if fmt == 'npy':
+        buf = io.BytesIO()
+        np.save(buf, image)
+        return buf.getvalue()
+    params = [LEVEL_PARAMS[fmt], level] if level is not None else []
+    success, buf = cv2.imencode(f'.{fmt}', image, params)
+    if not success:
+        raise ValueError(f"Cannot encode {fmt}")
+    return buf.tobytes()
+
+
+def part_path(path: Path) -> Path:
+    # Outputs are written here and renamed, so a crash never leaves a truncated file.
+    return path.with_name(f'{path.name}.part')
+
+
+def benchmark_table(fmt: str, level: int | None, timer: StageTimer) -> list[str]:
+    frames = max(timer.counts.get('frames', 0), 1)
+    encode_ms = timer.totals.get('encode', 0.0) * 1000 / frames
+    write_ms = timer.totals.get('write', 0.0) * 1000 / frames
+    bytes_per_frame = timer.counts.get('bytes', 0) / frames
+    level_str = str(level) if level is not None else 'default'
+    return [
+        f"{'format':>8} {'level':>8} {'frames':>8} {'encode ms/frame':>16} {'write ms/frame':>15} {'bytes/frame':>12}",
+        f"{fmt:>8} {level_str:>8} {timer.counts.get('frames', 0):>8} {encode_ms:>16.3f} {write_ms:>15.3f} {bytes_per_frame:>12.0f}"
+    ]
+
+
+class ImageWriter:
+    def __init__(self, threads: int = 2, maxsize: int = 8, timer: StageTimer | None = None,
+                 fmt: str = 'png', level: int | None = None,
+                 saved: Callable[[Path], None] | None = None) -> None:
+        # A bounded queue blocks the decoder when writers fall behind.
+        self.queue: queue.Queue = queue.Queue(maxsize)
+        self.timer = timer if timer is not None else StageTimer()
+        self.fmt = fmt
+        self.level = level
+        self.saved = saved
+        self.threads = [
+            threading.Thread(target=self.work, daemon=True) for _ in range(threads)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, save_img: Path, image: np.ndarray) -> None:
+        with self.timer.stage('queue wait'):
+            self.queue.put((save_img, image))
+
+    def work(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            save_img, image = item
+            try:
+                self.write(save_img, image)
+            except Exception as e:
+                logging.error(f"Cannot save {save_img}: {e}")
+
+    def write(self, save_img: Path, image: np.ndarray) -> None:
+        with self.timer.stage('encode'):
+            data = encode(image, self.fmt, self.level)
+        with self.timer.stage('write'):
+            part = part_path(save_img)
+            part.write_bytes(data)
+            os.replace(part, save_img)
+        self.timer.count('frames')
+        self.timer.count('bytes', len(data))
+        logging.info(f"{save_img} is saved.")
+        if self.saved is not None:
+            self.saved(save_img)
+
+    def close(self) -> None:
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class MemoryWriter:
+    # Encoded frames are kept to be packed into shards by the main process.
+    def __init__(self, timer: StageTimer | None = None, fmt: str = 'png',
+                 level: int | None = None) -> None:
+        self.timer = timer if timer is not None else StageTimer()
+        self.fmt = fmt
+        self.level = level
+        self.images: dict[int, bytes] = {}
+
+    def put(self, frame: int, image: np.ndarray) -> None:
+        with self.timer.stage('encode'):
+            data = encode(image, self.fmt, self.level)
+        self.images[frame] = data
+        self.timer.count('frames')
+        self.timer.count('bytes', len(data))
+
+    def close(self) -> None:
+        pass
+
+
+class BatchWriter:
+    # All frames of a video go to one .npy, which np.load(mmap_mode='r') can map.
+    def __init__(self, save_file: Path, count: int, timer: StageTimer | None = None) -> None:
+        self.save_file = save_file
+        self.part = part_path(save_file)
+        self.count = count
+        self.timer = timer if timer is not None else StageTimer()
+        self.batch: np.memmap | None = None
+        self.frames: list[int] = []
+
+    def put(self, frame: int, image: np.ndarray) -> None:
+        with self.timer.stage('write'):
+            if self.batch is None:
+                self.batch = np.lib.format.open_memmap(
+                    self.part, mode='w+', dtype=image.dtype, shape=(self.count, *image.shape))
+            if image.shape != self.batch.shape[1:]:
+                logging.warning(
+                    f"Frame {frame} has shape {image.shape}, but batch is {self.batch.shape[1:]}. Skipped")
+                return
+            self.batch[len(self.frames)] = image
+        self.frames.append(frame)
+        self.timer.count('frames')
+        self.timer.count('bytes', image.nbytes)
+
+    def close(self) -> None:
+        if self.batch is None:
+            return
+        with self.timer.stage('write'):
+            self.batch.flush()
+            filled = np.array(self.batch[:len(self.frames)]) \
+                if len(self.frames) < self.count else None
+            # The map is closed before the file is rewritten or renamed.
+            self.batch = None
+            if filled is not None:
+                with open(self.part, 'wb') as f:
+                    np.save(f, filled)
+            frames_file = self.save_file.with_name(f'{self.save_file.stem}_frames.npy')
+            with open(part_path(frames_file), 'wb') as f:
+                np.save(f, np.array(self.frames, dtype=np.int64))
+            os.replace(part_path(frames_file), frames_file)
+            os.replace(self.part, self.save_file)
+        logging.info(f"{self.save_file} is saved with {len(self.frames)} frames.")
@@ -4,7 +4,7 @@ from numbers import Number
 import re
 from dataclasses import dataclass
 from dacite import from_dict
-import pandas as pd
+import numpy as np
 import logging
 
 from mbdef import real
@@ -150,16 +150,23 @@ class Human:
         ret = ' '.join(spaced)
         return ret
 
-    def mk_part_info(self, inits: pd.DataFrame) -> str:
+    @property
+    def PART_INITS(self) -> dict[int, str]:
+        # Rows of a part that the person's inits are added to, by column of the inits.
+        return {16: 'trans', 17: 'phi', 18: 'vel', 19: 'omega'}
+
+    def format_row(self, value: Number | None, label: str, width: int, is_float: bool) -> str:
+        if value == None:
+            return f"{label}\n"
+        return f"{self.insert_rspace(value, width, is_float)} {label}\n"
+
+    def part_rows(self) -> list[tuple[Number | None, str, int, bool]]:
+        # (value, label, width, is_float) of each line of the part.
+        # Init vectors are of the part alone, before the person's inits are added.
         part_obj = self.part
         part_name = self.part.name
         part_num = self.PART_IDX[part_name]
 
-        inits = inits.set_axis(
-            ['trans', 'phi', 'vel', 'omega'], axis='columns')
-
-        trans, phi, vel, omega = inits['trans'], inits['phi'], inits['vel'], inits['omega']
-
         idx_to_omega_val: list[Number] = [
             self.PARTS_NUM * self.num + part_num,
             self.INIT_SYS_NUM + self.num,
@@ -177,10 +184,10 @@ class Human:
             part_obj.friction2ground,
             part_obj.friction2car,
             part_obj.abcn,
-            (part_obj.init_pos + trans).to_list(),
-            (part_obj.init_phi + phi).to_list(),
-            (part_obj.init_vel + vel).to_list(),
-            (part_obj.init_omega + omega).to_list()
+            part_obj.init_pos,
+            part_obj.init_phi,
+            part_obj.init_vel,
+            part_obj.init_omega
         ]
         idx_to_omega_str: list[str] = [
             '(Index)',
@@ -207,19 +214,19 @@ class Human:
         idx_to_omega = zip(idx_to_omega_val, idx_to_omega_str)
         not_floats = [0, 1, 3, 4, 5, 7]
 
-        info = ""
+        rows = []
         for i, (v, s) in enumerate(idx_to_omega):
-            if i in not_floats:
-                is_float = False
-            else:
-                is_float = True
-            if v == None:
-                info += f"{s}\n"
-            elif 'color' in s:
-                info += f"{self.insert_rspace(v, 3, is_float=is_float)} {s}\n"
-            else:
-                info += f"{self.insert_rspace(v, self.SPACE, is_float)} {s}\n"
-        return info
+            width = 3 if 'color' in s else self.SPACE
+            rows.append((v, s, width, i not in not_floats))
+        return rows
+
+    def mk_part_info(self, inits: np.ndarray) -> str:
+        # inits are (init, axis) of the person, as in Scene.
+        rows = self.part_rows()
+        for i, init in zip(self.PART_INITS, inits.tolist()):
+            v, s, width, is_float = rows[i]
+            rows[i] = ([b + c for b, c in zip(v, init)], s, width, is_float)
+        return ''.join(self.format_row(*row) for row in rows)
 
     def get_joinparts_idx(self, bodies: tuple[str]) -> tuple[Number]:
         if not isinstance(bodies, tuple):
@@ -232,14 +239,15 @@ class Human:
             ret.append(self.PART_IDX[body])
         return tuple(ret)
 
-    def mk_joint_info(self) -> str:
+    def joint_rows(self) -> list[tuple[Number, str, int, bool]]:
+        # (value, label, width, is_float) of each line of the joint after its number.
+        # Bodies are the part numbers within the person.
         joint_obj = self.joint
         bodies = self.get_joinparts_idx(joint_obj.body)
-        joint_no = self.NO_IDX[bodies]
 
         type_to_rad_val: list[Number] = [
             joint_obj.first_Type,
-            (pd.Series(bodies) + self.PARTS_NUM * self.num).to_list(),
+            bodies,
             joint_obj.friction,
             joint_obj.joint_pos1,
             joint_obj.joint_pos2,
@@ -268,17 +276,22 @@ class Human:
         type_to_rad = zip(type_to_rad_val, type_to_rad_str)
         not_floats = [0, 1, 8, 9, 10, 11]
 
-        info = f"No.: {self.insert_rspace(self.JOINT_NUM * self.num + joint_no, 4, is_float=False)}\n\n"
+        rows = []
         for i, (v, s) in enumerate(type_to_rad):
-            if i in not_floats:
-                is_float = False
-            else:
-                is_float = True
-            if 'Joint type' in s:
-                info += f"{self.insert_rspace(v, 4, is_float)} {s}\n"
-            else:
-                info += f"{self.insert_rspace(v, self.SPACE, is_float)} {s}\n"
-        return info
+            width = 4 if 'Joint type' in s else self.SPACE
+            rows.append((v, s, width, i not in not_floats))
+        return rows
+
+    def mk_joint_info(self) -> str:
+        bodies = self.get_joinparts_idx(self.joint.body)
+        joint_no = self.NO_IDX[bodies]
+
+        rows = self.joint_rows()
+        v, s, width, is_float = rows[1]
+        rows[1] = ([b + self.PARTS_NUM * self.num for b in v], s, width, is_float)
+
+        info = f"No.: {self.insert_rspace(self.JOINT_NUM * self.num + joint_no, 4, is_float=False)}\n\n"
+        return info + ''.join(self.format_row(*row) for row in rows)
 
 
 class Korean(Human):
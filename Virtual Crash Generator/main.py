@@ -1,23 +1,32 @@
 import os
-import sys
-import pandas as pd
+import argparse
+import itertools
 import logging
 import colorlog
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
 
 import human
+import scene as sc
 import translate as tl
 import mbdef as mdf
 
 
 def main():
-    mans_num = int(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Create people data for VIRTUAL CRASH.")
+    parser.add_argument('humans', type=int, help="number of humans")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes to render people in. Output is the same for any number")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    mans_num = args.humans
 
     place_how = tl.Square((0, 0, 0), mans_num)
     logging.info(f"Total people \033[35m{mans_num}")
     logging.info(f"Place mode \033[33m{place_how.__class__.__name__}")
-    parag_idx = ""
-    parpag_no = ""
+    scene = sc.Scene(mans_num)
     gen_trans = place_how.trans('rt')
     print("")
 
@@ -27,28 +36,41 @@ def main():
             f"Person \033[35m{m} \033[33m{person.__class__.__name__}\033[0m is on")
         trans = gen_trans.__next__()
         logging.info(f"Placed at \033[35m{tuple(trans)}")
-        phi = [0, 0, 0]
-        vel = [0, 0, 0]
-        omega = [0, 0, 0]
-        inits = pd.DataFrame({
-            'trans': trans,
-            'phi': phi,
-            'vel': vel,
-            'omega': omega
-        }, dtype=float)
-        parag_idx += mdf.context_idx(person, inits)
-        parpag_no += mdf.context_no(person)
+        scene.trans[m] = trans
+        scene.phi[m] = [0, 0, 0]
+        scene.vel[m] = [0, 0, 0]
+        scene.omega[m] = [0, 0, 0]
         print("")
 
     total_joints = f"{person.JOINT_NUM * mans_num} Joints\n"
 
-    text = mdf.context_headline(mans_num)
-    text += parag_idx + total_joints + parpag_no
-    text += person.LINE + mdf.context_ellip_mat()
-
     save_path = Path("results")
     save_path.mkdir(parents=True, exist_ok=True)
-    mdf.write(text, save_path)
+
+    # Body and joint sections are made person by person while they are written,
+    # so the whole text is never held in memory.
+    if args.workers == 1:
+        body = mdf.crowd_idx(person, range(mans_num), scene.inits)
+        joints = mdf.crowd_no(person, range(mans_num))
+        mdf.write(file_text(person, mans_num, total_joints, body, joints), save_path)
+    else:
+        logging.info(f"Workers \033[35m{args.workers}")
+        with ProcessPoolExecutor(args.workers) as pool:
+            # Chunks of people are merged in order, the same as with one process.
+            body = mdf.pool_idx(pool, person, scene.inits, args.workers)
+            joints = mdf.pool_no(pool, person, mans_num, args.workers)
+            mdf.write(file_text(person, mans_num, total_joints, body, joints), save_path)
+
+
+def file_text(person: human.Human, mans_num: int, total_joints: str,
+              body: Iterable[str], joints: Iterable[str]) -> Iterator[str]:
+    return itertools.chain(
+        [mdf.context_headline(mans_num)],
+        body,
+        [total_joints],
+        joints,
+        [person.LINE + mdf.context_ellip_mat()]
+    )
 
 
 if __name__ == "__main__":
@@ -1,12 +1,20 @@
+from collections import deque
+from concurrent.futures import Executor
 from decimal import Decimal
-from typing import Type, TYPE_CHECKING
-import pandas as pd
+from typing import Callable, Iterable, Iterator, Type, TYPE_CHECKING
+import numpy as np
 from pathlib import Path
 import logging
 
 if TYPE_CHECKING:
     from human import Human
 
+# People whose numbers are made together as arrays.
+CHUNK = 1024
+# People rendered by a worker at a time. Their text is sent back as one string.
+POOL_CHUNK = 256
+BUFFER_SIZE = 1 << 20
+
 
 def context_headline(humans: int) -> str:
     headline = (
@@ -19,22 +27,164 @@ def context_headline(humans: int) -> str:
     return headline
 
 
-def context_idx(man: Type['Human'], inits: pd.DataFrame) -> str:
-    info = ""
-    for part in man.PART_IDX.values():
-        info += man.LINE
-        man.set_data_part(part)
-        info += man.mk_part_info(inits)
-    return info
+class Template:
+    # The text of every person of a Human subclass is the same except for the index,
+    # system number, init vectors and bodies. These are slots of a format string
+    # rendered once, so a person is made by filling in its numbers.
+    def __init__(self, man: 'Human') -> None:
+        self.man = man
+        part_nums: list[int] = []
+        bases: list[list[tuple]] = []
+        idx = ""
+        # The same with init vectors as text, for people %f does not round like real.
+        idx_text = ""
+        for part in man.PART_IDX.values():
+            idx += escape(man.LINE)
+            idx_text += escape(man.LINE)
+            man.set_data_part(part)
+            rows = man.part_rows()
+            part_nums.append(man.PART_IDX[man.part.name])
+            bases.append([rows[i][0] for i in man.PART_INITS])
+            for i, (v, s, width, is_float) in enumerate(rows):
+                if i in [0, 1]:
+                    idx += f"%{width}d {escape(s)}\n"
+                    idx_text += f"%{width}d {escape(s)}\n"
+                elif i in man.PART_INITS:
+                    idx += ' '.join([f"%{width}.{man.FLOAT_DIGIT}f"] * len(v)) + f" {escape(s)}\n"
+                    idx_text += ' '.join([f"%{width}s"] * len(v)) + f" {escape(s)}\n"
+                else:
+                    idx += escape(man.format_row(v, s, width, is_float))
+                    idx_text += escape(man.format_row(v, s, width, is_float))
+        self.idx = idx
+        self.idx_text = idx_text
+        self.part_nums = np.array(part_nums, dtype=np.int64)
+        # (part, init, axis)
+        self.bases = np.array(bases, dtype=float)
+
+        joint_nos: list[int] = []
+        bodies: list[tuple[int, int]] = []
+        no = ""
+        for joi in man.NO_IDX.values():
+            no += escape(man.LINE)
+            man.set_data_joint(joi)
+            joint_bodies = man.get_joinparts_idx(man.joint.body)
+            joint_nos.append(man.NO_IDX[joint_bodies])
+            bodies.append(joint_bodies)
+            no += "No.: %4d\n\n"
+            for i, (v, s, width, is_float) in enumerate(man.joint_rows()):
+                if i == 1:
+                    no += ' '.join([f"%{width}d"] * len(v)) + f" {escape(s)}\n"
+                else:
+                    no += escape(man.format_row(v, s, width, is_float))
+        self.no = no
+        self.joint_nos = np.array(joint_nos, dtype=np.int64)
+        self.bodies = np.array(bodies, dtype=np.int64)
+
+    def iter_idx(self, nums: Iterable[int], inits: np.ndarray) -> Iterator[str]:
+        # Body text of each person. inits are (person, init, axis) in the order of
+        # PART_INITS. The numbers of CHUNK people are made at once as arrays.
+        man = self.man
+        nums = np.asarray(nums, dtype=np.int64)
+        inits = np.asarray(inits, dtype=float)
+        parts = len(self.part_nums)
+        for start in range(0, len(nums), CHUNK):
+            chunk = nums[start:start + CHUNK]
+            vecs = (self.bases + inits[start:start + CHUNK, None]).reshape(len(chunk), parts, -1)
+            values = np.empty((len(chunk), parts, 2 + vecs.shape[2]), dtype=object)
+            values[:, :, 0] = man.PARTS_NUM * chunk[:, None] + self.part_nums
+            values[:, :, 1] = (man.INIT_SYS_NUM + chunk)[:, None]
+            values[:, :, 2:] = vecs
+            exact = rounds_like_real(vecs, man.FLOAT_DIGIT).reshape(len(chunk), -1).all(axis=1)
+            for row, is_exact in zip(values.reshape(len(chunk), -1).tolist(), exact.tolist()):
+                if is_exact:
+                    yield self.idx % tuple(row)
+                else:
+                    yield self.idx_text % tuple(
+                        str(real(str(v), man.FLOAT_DIGIT)).upper() if isinstance(v, float) else v
+                        for v in row)
+
+    def iter_no(self, nums: Iterable[int]) -> Iterator[str]:
+        # Joint text of each person.
+        man = self.man
+        nums = np.asarray(nums, dtype=np.int64)
+        for start in range(0, len(nums), CHUNK):
+            chunk = nums[start:start + CHUNK, None]
+            values = np.concatenate([
+                (man.JOINT_NUM * chunk + self.joint_nos)[:, :, None],
+                (man.PARTS_NUM * chunk[:, :, None] + self.bodies)
+            ], axis=2)
+            for row in values.reshape(len(chunk), -1).tolist():
+                yield self.no % tuple(row)
+
+
+templates: dict[type, Template] = {}
+
+
+def escape(text: str) -> str:
+    return text.replace('%', '%%')
+
+
+def template(man: 'Human') -> Template:
+    # Compiled once for each Human subclass.
+    if type(man) not in templates:
+        templates[type(man)] = Template(man)
+    return templates[type(man)]
+
+
+def context_idx(man: Type['Human'], inits: np.ndarray) -> str:
+    return next(template(man).iter_idx([man.num], [inits]))
 
 
 def context_no(man: Type['Human']) -> str:
-    info = ""
-    for joi in man.NO_IDX.values():
-        info += man.LINE
-        man.set_data_joint(joi)
-        info += man.mk_joint_info()
-    return info
+    return next(template(man).iter_no([man.num]))
+
+
+def crowd_idx(man: Type['Human'], nums: Iterable[int], inits: np.ndarray) -> Iterator[str]:
+    return template(man).iter_idx(nums, inits)
+
+
+def crowd_no(man: Type['Human'], nums: Iterable[int]) -> Iterator[str]:
+    return template(man).iter_no(nums)
+
+
+def render_idx(kind: type['Human'], start: int, inits: np.ndarray) -> str:
+    # Body text of the people from start, in a worker process.
+    nums = range(start, start + len(inits))
+    return ''.join(crowd_idx(kind(start), nums, inits))
+
+
+def render_no(kind: type['Human'], start: int, stop: int) -> str:
+    # Joint text of the people from start to stop, in a worker process.
+    return ''.join(crowd_no(kind(start), range(start, stop)))
+
+
+def in_order(pool: Executor, calls: Iterable[tuple[Callable, ...]], ahead: int) -> Iterator[str]:
+    # Results of the calls in the order given. At most ahead calls are queued,
+    # so finished text does not pile up while it is written.
+    pending = deque()
+    for call in calls:
+        pending.append(pool.submit(*call))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def pool_idx(pool: Executor, man: Type['Human'], inits: np.ndarray, workers: int) -> Iterator[str]:
+    # Same text as crowd_idx for people 0 to len(inits), made by contiguous chunks in the pool.
+    calls = (
+        (render_idx, type(man), start, inits[start:start + POOL_CHUNK])
+        for start in range(0, len(inits), POOL_CHUNK)
+    )
+    return in_order(pool, calls, 2 * workers)
+
+
+def pool_no(pool: Executor, man: Type['Human'], humans: int, workers: int) -> Iterator[str]:
+    calls = (
+        (render_no, type(man), start, min(start + POOL_CHUNK, humans))
+        for start in range(0, humans, POOL_CHUNK)
+    )
+    return in_order(pool, calls, 2 * workers)
 
 
 def context_ellip_mat() -> str:
@@ -47,15 +197,29 @@ def real(k: float | str, digit: int) -> Decimal:
     return Decimal(k).quantize(Decimal(f'.{d}'))
 
 
-def write(text: str, save_path: Path, is_mbdef: bool = True) -> None:
+def rounds_like_real(values: np.ndarray, digit: int) -> np.ndarray:
+    # %f rounds the binary value, but real rounds its shortest decimal text.
+    # They differ only near a tie, and above 1e9 ties are too close to tell.
+    # NaN and infinities are left to real as well.
+    with np.errstate(invalid='ignore'):
+        scaled = np.abs(values) * 10**digit
+        tie = np.abs(scaled - np.floor(scaled) - 0.5) <= 4 * np.spacing(scaled)
+        return ~tie & (np.abs(values) < 1e9)
+
+
+def write(text: str | Iterable[str], save_path: Path, is_mbdef: bool = True) -> None:
+    # text can be given in pieces, which are written as they come.
     fname = f"gen_{len(list(save_path.glob('*')))}.txt"
     fpath = save_path / fname
     encoding = 'shift_jis'
-    file = open(fpath, mode='w', encoding=encoding)
+    file = open(fpath, mode='w', encoding=encoding, buffering=BUFFER_SIZE)
     logging.info(f"File \033[36m{fname}\033[0m is created")
     logging.warning(f"Encoding with \033[31m{encoding}")
 
-    file.write(text)
+    if isinstance(text, str):
+        text = [text]
+    for piece in text:
+        file.write(piece)
     file.close()
     if not is_mbdef:
         logging.info(f"File \033[36m{fname}\033[0m is saved")
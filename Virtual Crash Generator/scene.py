@@ -0,0 +1,33 @@
+import numpy as np
+
+
+class Scene:
+    # Initial states of all people in one (person, init, axis) array.
+    # Inits are in the order of Human.PART_INITS.
+    INITS = ['trans', 'phi', 'vel', 'omega']
+
+    def __init__(self, humans: int) -> None:
+        self.inits = np.zeros((humans, len(self.INITS), 3), dtype=float)
+
+    def __len__(self) -> int:
+        return len(self.inits)
+
+    def __getitem__(self, num: int) -> np.ndarray:
+        # (init, axis) of a person, as a view
+        return self.inits[num]
+
+    @property
+    def trans(self) -> np.ndarray:
+        return self.inits[:, 0]
+
+    @property
+    def phi(self) -> np.ndarray:
+        return self.inits[:, 1]
+
+    @property
+    def vel(self) -> np.ndarray:
+        return self.inits[:, 2]
+
+    @property
+    def omega(self) -> np.ndarray:
+        return self.inits[:, 3]